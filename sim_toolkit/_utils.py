@@ -78,6 +78,44 @@ def warn_once(msg: str, *, key: str | None = None, print_fn=print) -> None:
         __once_keys.add(k)
     print_fn(f"[SIM Toolkit] {msg}")
 
+# ---------- parallel decoding ----------
+def default_num_threads() -> int:
+    """Threads used to decode dataset files when not set by the user."""
+    return max(1, min(8, os.cpu_count() or 1))
+
+def thread_map_ordered(fn, items, num_threads: int | None = None):
+    """
+    Apply `fn` to each item in a bounded thread pool and yield (item, result, error)
+    in input order, with `error` set (and `result` None) if `fn` raised.
+    At most 2 * num_threads items are in flight, so memory stays bounded when
+    the results are consumed as a stream.
+    """
+    num_threads = default_num_threads() if num_threads is None else max(1, int(num_threads))
+
+    def call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, e
+
+    items = list(items)
+    if num_threads == 1 or len(items) <= 1:
+        for item in items:
+            yield (item, *call(item))
+        return
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        pending = deque()
+        next_idx = 0
+        while pending or next_idx < len(items):
+            while next_idx < len(items) and len(pending) < 2 * num_threads:
+                pending.append((items[next_idx], pool.submit(call, items[next_idx])))
+                next_idx += 1
+            item, future = pending.popleft()
+            yield (item, *future.result())
+
 # ---------- array shape helpers ----------
 def _to_chw(arr: np.ndarray) -> np.ndarray:
     """
@@ -110,6 +148,9 @@ def _class_path_from_obj(cls) -> str:
     return f"{cls.__module__}.{cls.__name__}"
 
 def _infer_dataset_from_path(path: str) -> str:
+    from .datasets.packed import is_packed_dataset
+    if is_packed_dataset(path):
+        return "packed"
     p = str(path).lower()
     if p.endswith((".nii", ".nii.gz")):
         return "nifti"
@@ -132,7 +173,7 @@ def _dataset_class_name(
     Return a fully-qualified class path for dnnlib.util.construct_class_by_name().
 
     Accepts:
-      - short names: "nifti", "jpeg", "tiff", "png", "dicom", "auto"
+      - short names: "nifti", "jpeg", "tiff", "png", "dicom", "packed", "auto"
       - fully-qualified strings: "pkg.mod.Class" or "pkg.mod:Class"
       - a class object (e.g., NiftiDataset2D)
       - a filesystem path to a .py file (optionally with a class):
@@ -166,7 +207,7 @@ def _dataset_class_name(
         name = name.replace(":", ".")
 
     # If it's already fully-qualified, trust it and don't override based on data_type
-    if "." in name and name not in {"nifti", "jpeg", "tiff", "png", "dicom", "auto"}:
+    if "." in name and name not in {"nifti", "jpeg", "tiff", "png", "dicom", "packed", "auto"}:
         return name
 
     # auto-detect base dataset by extension
@@ -182,11 +223,13 @@ def _dataset_class_name(
         "jpeg":         "sim_toolkit.datasets.jpeg.JPEGDataset",
         "tiff":         "sim_toolkit.datasets.tiff.TifDataset",
         "dcm":          "sim_toolkit.datasets.dcm.DicomDataset2D",
+        "packed":       "sim_toolkit.datasets.packed.PackedDataset",
     }
     mapping_3d = {
         "nifti":        "sim_toolkit.datasets.nifti.NiftiDataset3D",     # 3D
         "tiff":         "sim_toolkit.datasets.tiff.TifDataset",
         "dcm":          "sim_toolkit.datasets.dcm.DicomDataset3D",
+        "packed":       "sim_toolkit.datasets.packed.PackedDataset",
     }
 
     if dtype == "3d":
@@ -227,6 +270,48 @@ def _mk_dataset_kwargs(dataset, params: dict | None, *, data_type: str) -> dnnli
     class_name = _dataset_class_name(dataset, data_type=data_type, path_data=(params or {}).get("path_data"))
     return dnnlib.EasyDict(class_name=class_name, **(params or {}))
 
+def _iter_dataset_files(path: str):
+    """Yield (relative path, absolute path) for every file under `path`, in sorted order."""
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        yield os.path.basename(path), path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            yield os.path.relpath(full, path).replace(os.sep, "/"), full
+
+def file_signature(path: str, *, hash_content: bool = False, sample_bytes: int = 8192) -> str:
+    """
+    Cheap signature of a single file: its size plus either
+      - its modification time (default), or
+      - a hash of its first/last `sample_bytes` (hash_content=True), which is
+        stable across machines and copies of the same data.
+    """
+    st = os.stat(path)
+    if not hash_content:
+        return f"{st.st_size}:{st.st_mtime_ns}"
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        md5.update(f.read(sample_bytes))
+        if st.st_size > 2 * sample_bytes:
+            f.seek(-sample_bytes, os.SEEK_END)
+            md5.update(f.read(sample_bytes))
+    return f"{st.st_size}:{md5.hexdigest()}"
+
+def dataset_fingerprint(path: str, *, hash_content: bool = False, sample_bytes: int = 8192) -> str:
+    """
+    Cheap fingerprint of the files a dataset is read from (a file or a folder tree):
+    the relative path and the signature (see file_signature) of every file.
+    """
+    md5 = hashlib.md5()
+    md5.update(b"content" if hash_content else b"stat")
+    for rel, full in _iter_dataset_files(path):
+        sig = file_signature(full, hash_content=hash_content, sample_bytes=sample_bytes)
+        md5.update(f"{rel}\0{sig}\n".encode("utf-8"))
+    return md5.hexdigest()
+
 # ---------------------------------------------------------------------
 
 
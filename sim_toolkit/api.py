@@ -4,9 +4,8 @@
 from __future__ import annotations
 
 import os
-import sys
 import tempfile
-from typing import Dict, List, Optional, Any, Callable
+from typing import Dict, List, Optional, Any, Callable, Union
 
 from copy import deepcopy
 import random
@@ -45,11 +44,15 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
     from .metrics.create_report import generate_metrics_report
 
     dnnlib.util.Logger(should_flush=True)
+    if args.cache_dir is not None:
+        dnnlib.util.set_cache_dir(args.cache_dir)
 
     # Seed & device
     set_global_seed(args.seed)
     multi = (args.num_gpus > 1)
     device = _resolve_device(args.device, rank, multi)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
 
     # Init torch.distributed
     if args.num_gpus > 1 and device.type == "cuda":
@@ -80,10 +83,17 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
         torch.backends.cuda.matmul.allow_tf32 = False
         torch.backends.cudnn.allow_tf32 = False
 
+    # Datasets are built once per run and shared by the grids, the metrics and the report.
+    # With several ranks, each one only loads in memory the items it embeds.
+    # Building a sharded dataset is a collective operation, so every rank builds them here.
+    dataset_registry = metric_utils.DatasetRegistry(shard=(rank, args.num_gpus) if args.num_gpus > 1 else None)
+    real_dataset = dataset_registry.get(args.dataset_kwargs)
+    if not args.use_pretrained_generator:
+        synt_dataset = dataset_registry.get(args.dataset_synt_kwargs)
+
     # Visualize samples (rank 0 only)
     if rank == 0:
         # ----------------   Real dataset   ----------------
-        real_dataset = dnnlib.util.construct_class_by_name(**args.dataset_kwargs)
         drange_real = [real_dataset._min, real_dataset._max]
         W, H = real_dataset._raw_shape[2], real_dataset._raw_shape[3]
         n_real = len(real_dataset)
@@ -93,7 +103,6 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
             max_synt = args.num_gen if args.num_gen is not None else n_real
             n_common = max(1, min(n_real, max_synt))
         else:
-            synt_dataset = dnnlib.util.construct_class_by_name(**args.dataset_synt_kwargs)
             drange_synt = [synt_dataset._min, synt_dataset._max]
             Ws, Hs = synt_dataset._raw_shape[2], synt_dataset._raw_shape[3]
             assert (W == Ws) and (H == Hs), f"Real dataset image size {(W,H)} differs from synthetic dataset image size {(Ws,Hs)}"
@@ -116,7 +125,6 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
             num_images = grid_size[0] * grid_size[1]
             images_synt = metric_utils.setup_grid_generated(args, args.G, labels, grid_size, num_images, real_dataset, device)
         else:
-            synt_dataset = dnnlib.util.construct_class_by_name(**args.dataset_synt_kwargs)
             images_synt, _ = metric_utils.setup_snapshot_image_grid(synt_dataset, grid_size)
         drange_synt = [images_synt.min(), images_synt.max()]
         if args.data_type.lower() == "3d":
@@ -128,6 +136,9 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
     if args.num_gpus > 1 and dist.is_initialized():
         dist.barrier()
 
+    # Features extracted by one metric are reused by the following ones
+    feature_store = metric_utils.FeatureStore()
+
     # Compute metrics
     for metric in args.metrics:
         if rank == 0 and args.verbose:
@@ -162,6 +173,15 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
             rank=rank,
             device=device,
             progress=progress,
+            feature_store=feature_store,
+            dataset_registry=dataset_registry,
+            cache_content_hash=args.cache_content_hash,
+            feature_spill_dir=args.feature_spill_dir,
+            num_workers=args.num_workers,
+            prefetch_factor=args.prefetch_factor,
+            detector_precision=args.detector_precision,
+            tile_size_3d=args.tile_size_3d,
+            tile_overlap_3d=args.tile_overlap_3d,
         )
 
         if rank == 0:
@@ -173,7 +193,7 @@ def _subprocess_fn(rank: int, args: dnnlib.EasyDict, temp_dir: str):
             print()
 
     # Final report
-    generate_metrics_report(args)
+    generate_metrics_report(args, dataset_registry=dataset_registry)
 
     # Done
     if rank == 0 and args.verbose:
@@ -192,9 +212,17 @@ def compute(
     run_dir: str,
     num_gpus: int = 1,
     device: Optional[str] = None,
-    batch_size: int = 64,
+    batch_size: Union[int, str] = 64,     # or "auto" to tune the feature extraction batch size
+    num_workers: Optional[int] = None,     # DataLoader workers; None = automatic (see metric_utils.get_data_loader_kwargs)
+    prefetch_factor: Optional[int] = None, # batches prefetched by each worker; None = PyTorch default
+    detector_precision: str = "fp32",      # "fp32" | "bf16" | "int8" (feature extractors)
+    tile_size_3d: Optional[int] = None,    # 3D: extract features from overlapping patches of this size (voxels)
+    tile_overlap_3d: int = 32,             # 3D: overlap between neighbouring patches (voxels)
     data_type: str = "2D",                 # "2D" | "3D"
     use_cache: bool = True,
+    cache_dir: Optional[str] = None,       # defaults to $DNNLIB_CACHE_DIR or ~/.cache/dnnlib
+    cache_content_hash: bool = False,      # key the cache on sampled file contents instead of mtimes
+    feature_spill_dir: Optional[str] = None,  # keep extracted features in memory-mapped files here instead of RAM
     verbose: bool = True,
     padding: bool = False,
     seed: int = 42,
@@ -204,11 +232,11 @@ def compute(
     knn_num_real: int = 3,
     knn_num_synth: int = 5,
     # REAL data
-    real_dataset: str = "auto",                         # "nifti" | "dicom" | "tiff" | "jpeg" | "png" | "auto"
+    real_dataset: str = "auto",                         # "nifti" | "dicom" | "tiff" | "jpeg" | "png" | "packed" | "auto"
     real_params: Optional[Dict[str, Any]] = None,       # must include path_data
     # SYNTH data (choose one mode)
     # (A) from files:
-    synth_dataset: Optional[str] = "auto",               # "nifti" | "dicom" | "tiff" | "jpeg" | "png" | "auto"
+    synth_dataset: Optional[str] = "auto",               # "nifti" | "dicom" | "tiff" | "jpeg" | "png" | "packed" | "auto"
     synth_params: Optional[Dict[str, Any]] = None,       # must include path_data
     # (B) pretrained generator:
     use_pretrained_generator: bool = False,
@@ -220,6 +248,10 @@ def compute(
     """
     Programmatic entry-point. Mirrors the old CLI/config flow but takes Python args.
 
+    Dataset types (real_dataset / synth_dataset): "nifti", "dicom", "tiff", "jpeg", "png",
+    "packed" (created by `python -m sim_toolkit.datasets.packed`), "auto" (detected from the
+    files), or a custom class ("module.Class" or a .py file).
+
     Minimal examples:
     -----------------
     # From files (NIfTI)
@@ -232,6 +264,16 @@ def compute(
         synth_params={"path_data": "data/synth.nii.gz"},
     )
 
+    # From packed datasets (see sim_toolkit/datasets/packed.py)
+    compute(
+        metrics=["fid","kid"],
+        run_dir="./runs/exp1_packed",
+        real_dataset="packed",
+        real_params={"path_data": "data/real_packed"},
+        synth_dataset="packed",
+        synth_params={"path_data": "data/synth_packed"},
+    )
+
     # From a pretrained generator
     compute(
         metrics=["fid","kid", "prdc", "pr_auth", "knn"],
@@ -247,24 +289,8 @@ def compute(
     """
     os.makedirs(run_dir, exist_ok=True)
 
-    metrics_norm = {m.lower() for m in metrics}
-    dtype_norm = str(data_type).lower()
-
-    # Always need torch; tf only for the computation of 2D pr_auth and prdc
-    need_torch = True
-    need_tf = (dtype_norm == "2d") and bool({"pr_auth", "prdc", "knn"} & metrics_norm)
-
-    if need_tf and sys.version_info >= (3, 12):
-        raise RuntimeError(
-            "TensorFlow backend for 'pr_auth', 'prdc', and 'knn' is not supported on Python 3.12+ in this version of SIM Toolkit. "
-            "Please use Python 3.11 or disable 'pr_auth', 'prdc', and 'knn'."
-        )
-
-    require_backends(
-        need_torch=need_torch,
-        need_tf=need_tf,
-        reason=("core pipeline" if need_torch and not need_tf else "metrics 'pr_auth', 'prdc', and 'knn'")
-    )
+    # All the feature extractors (including VGG-16 for 2D pr_auth, prdc and knn) run on PyTorch
+    require_backends(need_torch=True, reason="core pipeline")
 
     import torch
     set_global_seed(seed)
@@ -295,8 +321,16 @@ def compute(
         "metrics": metrics,
         "run_dir": run_dir,
         "batch_size": batch_size,
+        "num_workers": num_workers,
+        "prefetch_factor": prefetch_factor,
+        "detector_precision": detector_precision,
+        "tile_size_3d": tile_size_3d,
+        "tile_overlap_3d": tile_overlap_3d,
         "data_type": data_type,
         "cache": use_cache,
+        "cache_dir": cache_dir,
+        "cache_content_hash": cache_content_hash,
+        "feature_spill_dir": feature_spill_dir,
         "knn_configs": knn_configs,
         "nhood_size": nhood_size,
         "padding": padding,
@@ -2,13 +2,17 @@
 # SPDX-License-Identifier: NPOSL-3.0
 
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import torch
 import torch.utils.data as data
 from glob import glob
 
 from .. import dnnlib
-from .._utils import warn_once
+from .._utils import warn_once, dataset_fingerprint, file_signature, thread_map_ordered
 
 __all__ = ["BaseDataset", "BidsDataset"]
 
@@ -19,15 +23,31 @@ class BaseDataset(data.Dataset):
             use_labels=False,       # Enable conditioning labels? False = label dimension is zero.
             size_dataset=None,      # Max size of the dataset
             random_seed = 0,        # Random seed to use when applying max_size.
+            lazy = False,           # Decode items on access instead of loading the whole dataset in memory.
+            num_threads = None,     # Threads used to decode files when loading/indexing the dataset (None = min(8, #CPUs)).
+            shard = None,           # (rank, world_size): only load the items idx % world_size == rank in memory, decode the others on access.
             **kwargs):
         self.path_data = path_data
+        self.num_threads = num_threads
         self.path_labels = path_labels
         self._use_labels = use_labels
         self._raw_labels = None
         self._label_shape = None
+        self._item_paths = None     # Set by _load_files() when each item is decoded from its own file
+        self._shard = tuple(shard) if (shard is not None and shard[1] > 1 and not lazy) else None
+        self._shard_items = None    # Items of this shard loaded in memory: item -> array
 
-        # Load dataset
-        self._data = self._load_files()
+        # Load dataset (with lazy=True, only index its files; with a shard, index all files and load the shard)
+        self._data = None
+        if lazy or self._shard is not None:
+            self._item_paths = self._index_files()
+            if self._item_paths is None:
+                option = "lazy=True" if lazy else "shard"
+                warn_once(f"{type(self).__name__} does not support {option} for {path_data}; loading the whole dataset in memory.",
+                          key=f"{option}.{type(self).__name__}")
+                self._shard = None
+        if self._item_paths is None:
+            self._data = self._load_files()
         self._labels = None
         if self._use_labels:
             if self.path_labels is not None:
@@ -42,10 +62,19 @@ class BaseDataset(data.Dataset):
 
         # Store dataset metadata
         self.name = os.path.basename(path_data)
-        self._raw_shape = list(self._data.shape)
-        self._dtype = self._data.dtype
-        self._min = self._data.min()
-        self._max = self._data.max()
+        if self._data is not None:
+            self._raw_shape = list(self._data.shape)
+            self._dtype = self._data.dtype
+            self._min = self._data.min()
+            self._max = self._data.max()
+        else:
+            stats = self._load_shard() if self._shard is not None else self._get_stats()
+            if stats['bad']:
+                self._item_paths = [p for p in self._item_paths if self._item_key(p) not in stats['bad']]
+            self._raw_shape = [len(self._item_paths)] + stats['shape']
+            self._dtype = np.dtype(stats['dtype'])
+            self._min = self._dtype.type(stats['min'])
+            self._max = self._dtype.type(stats['max'])
         
         # Apply max_size.
         self._raw_idx = np.arange(self._raw_shape[0], dtype=np.int64)
@@ -54,10 +83,17 @@ class BaseDataset(data.Dataset):
             self._raw_idx = np.sort(self._raw_idx[:size_dataset])
 
     def __len__(self):
-        return self._data.shape[0]
+        return self._raw_shape[0]
 
     def __getitem__(self, idx):
-        image = self._data[idx].astype(np.float32)
+        if self._data is not None:
+            image = self._data[idx].astype(np.float32)
+        else:
+            item = self._item_paths[idx]
+            image = self._shard_items.get(item) if self._shard_items is not None else None
+            if image is None:
+                image = self._decode_item(item)
+            image = np.asarray(image, dtype=np.float32)
         label = self._labels[idx] if self._labels is not None else -1
         return torch.from_numpy(image), torch.tensor(label, dtype=torch.int64)
 
@@ -77,6 +113,13 @@ class BaseDataset(data.Dataset):
         label = self._get_raw_labels()[self._raw_idx[idx]]
         return label.copy()
 
+    def item_paths(self):
+        """
+        Path of the file each item is decoded from, in dataset order,
+        or None if items do not map one-to-one to files.
+        """
+        return self._item_paths
+
     def get_details(self, idx):
         d = dnnlib.EasyDict()
         d.raw_idx = int(self._raw_idx[idx])
@@ -99,17 +142,286 @@ class BaseDataset(data.Dataset):
         
     def _load_files(self):
         """
-        Users must implement this function in subclasses.
+        Users must implement this function in subclasses, unless they implement
+        _index_files() and _decode_item() instead.
         Should return a NumPy array of shape (N, C, H, W).
+        The default implementation decodes the files in a pool of `num_threads` threads.
+        """
+        paths = self._index_files()
+        if paths is None:
+            raise NotImplementedError
+        images = []
+        loaded_paths = []
+        failed = []
+        for path, image, e in thread_map_ordered(self._decode_item, paths, self.num_threads):
+            if e is not None:
+                print(f"Warning: Could not load {path}: {e}")
+                failed.append((path, str(e)))
+                continue
+            images.append(image)
+            loaded_paths.append(path)
+
+        if not images:
+            raise self._no_images_error(failed)
+
+        shapes = {im.shape for im in images}
+        if len(shapes) != 1:
+            raise ValueError(
+                f"Inconsistent image shapes in {self.path_data}: {sorted(shapes)}. "
+                "Please resample/crop to a uniform (C,H,W) shape."
+            )
+
+        data = np.stack(images, axis=0)  # (N,C,H,W)
+        self._item_paths = loaded_paths
+        return data
+
+    # Name of the file format, used in error messages.
+    _format_name = "image"
+
+    def _index_files(self):
+        """
+        Subclasses can implement this function, together with _decode_item(), to
+        support lazy loading. Should return the sorted list of files to load,
+        one item per file, or None if the dataset cannot be indexed by file.
+        """
+        return None
+
+    def _decode_item(self, path):
+        """
+        Subclasses can implement this function, together with _index_files(), to
+        support lazy loading. Should return a NumPy array of shape (C, H, W).
+        Called from several threads at once, so it must not modify shared state.
         """
         raise NotImplementedError
 
+    def _decode_params(self):
+        """
+        Options that change the output of _decode_item(), used to key the cached dataset stats.
+        """
+        return {}
+
+    def _item_key(self, item):
+        """
+        Key of an item returned by _index_files() in the cached stats: its path relative
+        to path_data, or the item itself if it is not a path (e.g. an index within a file).
+        """
+        return os.path.relpath(item, self.path_data) if isinstance(item, str) else item
+
+    def _get_stats(self):
+        """
+        Shape, dtype and value range of a lazy dataset, computed by decoding every
+        item once. Files that cannot be decoded are reported and recorded as bad.
+        The result is cached on a fingerprint of the dataset files and on _decode_params().
+        """
+        key = repr((type(self).__module__, type(self).__qualname__, os.path.abspath(self.path_data), dataset_fingerprint(self.path_data)))
+        if self._decode_params():
+            key += repr(sorted(self._decode_params().items()))
+        cache_file = dnnlib.make_cache_dir_path('dataset-stats', hashlib.md5(key.encode('utf-8')).hexdigest() + '.json')
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                return json.load(f)
+
+        stats = self._new_stats()
+        failed = []
+        for path, image, e in thread_map_ordered(self._decode_item, self._item_paths, self.num_threads):
+            if e is not None:
+                print(f"Warning: Could not load {path}: {e}")
+                stats['bad'].append(self._item_key(path))
+                failed.append((path, str(e)))
+                continue
+            self._update_stats(stats, path, np.asarray(image))
+        if stats['shape'] is None:
+            raise self._no_images_error(failed)
+
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f'{cache_file}.{os.getpid()}'
+        with open(temp_file, 'w') as f:
+            json.dump(stats, f)
+        os.replace(temp_file, cache_file)
+        return stats
+
+    @staticmethod
+    def _new_stats():
+        return dict(shape=None, dtype=None, min=None, max=None, bad=[])
+
+    def _update_stats(self, stats, path, image):
+        if stats['shape'] is None:
+            stats.update(shape=list(image.shape), dtype=image.dtype.str, min=image.min().item(), max=image.max().item())
+        elif list(image.shape) != stats['shape']:
+            raise ValueError(
+                f"Inconsistent image shapes in {self.path_data}: {tuple(stats['shape'])} and {image.shape} ({path}). "
+                "Please resample/crop to a uniform (C,H,W) shape."
+            )
+        else:
+            stats.update(min=min(stats['min'], image.min().item()), max=max(stats['max'], image.max().item()))
+
+    def _load_shard(self):
+        """
+        Decode the items of this rank's shard into memory, and return the stats of the
+        whole dataset, merged from the stats of the shards of all the ranks.
+        Without a torch.distributed process group of world_size ranks, the stats are
+        computed by _get_stats() instead.
+        """
+        rank, world_size = self._shard
+        self._shard_items = dict()
+        stats = self._new_stats()
+        error = None
+        failed = []
+        for path, image, e in thread_map_ordered(self._decode_item, self._item_paths[rank::world_size], self.num_threads):
+            if e is not None:
+                print(f"Warning: Could not load {path}: {e}")
+                stats['bad'].append(self._item_key(path))
+                failed.append((path, str(e)))
+                continue
+            image = np.asarray(image)
+            try:
+                self._update_stats(stats, path, image)
+            except ValueError as e:
+                error = str(e) # Raised after the exchange, so that the other ranks do not wait forever
+                break
+            self._shard_items[path] = image
+
+        dist = torch.distributed
+        if not (dist.is_available() and dist.is_initialized() and dist.get_world_size() == world_size):
+            if error is not None:
+                raise ValueError(error)
+            warn_once(f"{type(self).__name__}: shard={self._shard} without a process group of {world_size} ranks; "
+                      "reading the whole dataset to compute its stats.", key=f"shard-stats.{type(self).__name__}")
+            return self._get_stats()
+        all_stats = [None] * world_size
+        dist.all_gather_object(all_stats, dict(stats, error=error, failed=failed[:5]))
+
+        merged = self._new_stats()
+        failed = []
+        for shard_stats in all_stats:
+            if shard_stats['error'] is not None:
+                raise ValueError(shard_stats['error'])
+            merged['bad'] += shard_stats['bad']
+            failed += shard_stats['failed']
+            if shard_stats['shape'] is None:
+                continue
+            if merged['shape'] is not None and shard_stats['shape'] != merged['shape']:
+                raise ValueError(
+                    f"Inconsistent image shapes in {self.path_data}: {tuple(merged['shape'])} and {tuple(shard_stats['shape'])}. "
+                    "Please resample/crop to a uniform (C,H,W) shape."
+                )
+            if merged['shape'] is None:
+                merged.update(shape=shard_stats['shape'], dtype=shard_stats['dtype'], min=shard_stats['min'], max=shard_stats['max'])
+            else:
+                merged.update(min=min(merged['min'], shard_stats['min']), max=max(merged['max'], shard_stats['max']))
+        if merged['shape'] is None:
+            raise self._no_images_error(failed)
+        return merged
+
+    def _no_images_error(self, failed):
+        """
+        Exception raised when no item could be decoded; `failed` lists the (item, reason)
+        of the items that could not be decoded. Subclasses can override it to explain
+        the requirements of their format.
+        """
+        return RuntimeError(f"No {self._format_name} images found in {self.path_data}")
+
     def _load_raw_labels(self):
         """
         Users must implement this function in subclasses if labels are used.
         """
         raise NotImplementedError
 
+class _VolumeCache:
+    """
+    Size-bounded LRU cache of decoded volumes, shared by all the datasets of a process.
+    Volumes can also be spilled to uncompressed .npy files, which are memory-mapped
+    on later reads (also by other processes and later runs).
+    """
+    def __init__(self):
+        self.max_bytes  = 0
+        self._items     = OrderedDict()    # key -> read-only array
+        self._bytes     = 0
+        self._loading   = dict()           # key -> Event, for volumes being decoded
+        self._lock      = threading.Lock()
+
+    def get(self, key, load, spill_dir=None):
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    return self._items[key]
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    break
+            event.wait() # Decoded by another thread
+        try:
+            array = self._load(key, load, spill_dir)
+            with self._lock:
+                if 0 < array.nbytes <= self.max_bytes and not isinstance(array, np.memmap):
+                    self._items[key] = array
+                    self._bytes += array.nbytes
+                    while self._bytes > self.max_bytes:
+                        _key, old = self._items.popitem(last=False)
+                        self._bytes -= old.nbytes
+            return array
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    @staticmethod
+    def _load(key, load, spill_dir):
+        spill_file = None
+        if spill_dir is not None:
+            spill_file = os.path.join(spill_dir, hashlib.md5(key.encode('utf-8')).hexdigest() + '.npy')
+            if os.path.isfile(spill_file):
+                return np.load(spill_file, mmap_mode='r')
+        array = np.ascontiguousarray(load())
+        array.setflags(write=False)
+        if spill_file is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            temp_file = f'{spill_file}.{os.getpid()}.{threading.get_ident()}.npy'
+            np.save(temp_file, array)
+            os.replace(temp_file, spill_file)
+        return array
+
+_volume_cache = _VolumeCache()
+
+class _Prefetcher:
+    """Background thread decoding the volumes of a BidsDataset ahead of the reader."""
+    def __init__(self, dataset, indices, read_ahead):
+        self._dataset   = dataset
+        self._indices   = indices
+        self._positions = {idx: pos for pos, idx in reversed(list(enumerate(indices)))}
+        self._read_ahead = read_ahead
+        self._consumed  = -1
+        self._stopped   = False
+        self._cond      = threading.Condition()
+        self._thread    = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def consumed(self, idx):
+        with self._cond:
+            pos = self._positions.get(idx)
+            if pos is not None and pos > self._consumed:
+                self._consumed = pos
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        for pos, idx in enumerate(self._indices):
+            with self._cond:
+                while not self._stopped and pos > self._consumed + self._read_ahead:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            try:
+                self._dataset._read_volume(self._dataset.inputfiles[self._dataset._raw_idx[idx]])
+            except Exception:
+                return # The error is raised again when the item is read
+
 class BidsDataset(data.Dataset):
     def __init__(self, 
             path_data,              # Path to the dataset
@@ -118,10 +430,20 @@ class BidsDataset(data.Dataset):
             size_dataset=None,      # Max size of the dataset
             random_seed = 0,        # Random seed to use when applying max_size.
             structure='sub-*/anat/*_T1w.nii.gz', # Define the structure of the NIfTI folder
+            cache_mb = 2048,        # RAM for decoded volumes, in an LRU cache shared by the datasets of the process (0 = disabled).
+            spill_dir = None,       # (optional) Directory where decoded volumes are saved uncompressed and memory-mapped on later reads (True = SIM Toolkit cache directory).
+            read_ahead = 4,         # Volumes decoded ahead of the sampler order by prefetch().
+            num_threads = None,     # Threads used to read the volumes in the statistics pass (None = min(8, #CPUs)).
             **kwargs):
         self.path_data = path_data
         self.path_labels = path_labels
         self.structure = structure
+        self.cache_mb = cache_mb
+        self.spill_dir = dnnlib.make_cache_dir_path('volumes') if spill_dir is True else spill_dir
+        self.read_ahead = read_ahead
+        self.num_threads = num_threads
+        self._prefetcher = None
+        _volume_cache.max_bytes = max(_volume_cache.max_bytes, int(cache_mb * 2**20))
         self._use_labels = use_labels
         self._raw_labels = None
         self._label_shape = None
@@ -176,36 +498,118 @@ class BidsDataset(data.Dataset):
         #self._data = self._load_files(self.path_data)
         self._labels = self._load_raw_labels() if use_labels and path_labels else None
 
-        # Store dataset metadata
-        self.name = os.path.basename(path_data)
-        example_img = self._load_files(self.inputfiles[0])
-        self._raw_shape = [len(self.inputfiles)] + list(example_img.shape)
-        self._dtype = example_img.dtype
-        self._min = example_img.min()
-        self._max = example_img.max()
-
         # Apply max_size.
         self._raw_idx = np.arange(len(self.inputfiles), dtype=np.int64)
         if size_dataset and len(self._raw_idx) > size_dataset:
             np.random.RandomState(random_seed).shuffle(self._raw_idx)
             self._raw_idx = np.sort(self._raw_idx[:size_dataset])
 
-    def update_minmax(self, image):
-        if image.min() < self._min:
-            self._min = image.min()
-        if image.max() > self._max:
-            self._max = image.max()
+        # Store dataset metadata
+        self.name = os.path.basename(path_data)
+        self._stats = self._get_stats()
+        self._raw_shape = [len(self.inputfiles)] + self._stats['shape']
+        self._dtype = np.dtype(self._stats['dtype'])
+        self._min = self._dtype.type(self._stats['min'])
+        self._max = self._dtype.type(self._stats['max'])
+
+    # Percentiles of the intensities stored by _get_stats().
+    _stats_percentiles = [0.5, 1, 5, 25, 50, 75, 95, 99, 99.5]
+
+    def _get_stats(self):
+        """
+        Shape, dtype, exact min/max and mean/std of the intensities of the selected volumes,
+        and percentiles estimated on up to 2**16 evenly spaced voxels per volume.
+        Computed in one parallel pass over the files, and cached on a fingerprint of the
+        dataset files, so that later runs (and DataLoader workers) get the same range
+        without reading the data.
+        """
+        files = [self.inputfiles[i] for i in self._raw_idx]
+        selection = hashlib.md5('\n'.join(os.path.relpath(f, self.path_data) for f in files).encode('utf-8')).hexdigest()
+        key = repr((type(self).__module__, type(self).__qualname__, os.path.abspath(self.path_data), selection, dataset_fingerprint(self.path_data)))
+        cache_file = dnnlib.make_cache_dir_path('dataset-stats', hashlib.md5(key.encode('utf-8')).hexdigest() + '.json')
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                return json.load(f)
+
+        stats = dict(shape=None, dtype=None, min=None, max=None)
+        total, total_sq, count, samples = 0.0, 0.0, 0, []
+        for path, volume, e in thread_map_ordered(self._read_volume, files, self.num_threads):
+            if e is not None:
+                raise RuntimeError(f"Could not load {path}: {e}") from e
+            if stats['shape'] is None:
+                stats.update(shape=list(volume.shape), dtype=volume.dtype.str, min=volume.min().item(), max=volume.max().item())
+            elif list(volume.shape) != stats['shape']:
+                raise ValueError(
+                    f"Inconsistent volume shapes in {self.path_data}: {tuple(stats['shape'])} and {volume.shape} ({path}). "
+                    "Please resample/crop to a uniform shape."
+                )
+            else:
+                stats.update(min=min(stats['min'], volume.min().item()), max=max(stats['max'], volume.max().item()))
+            flat = np.asarray(volume, dtype=np.float64).reshape(-1)
+            total += flat.sum()
+            total_sq += flat @ flat
+            count += flat.size
+            samples.append(flat[::max(1, flat.size // 2**16)])
+        mean = total / count
+        stats.update(
+            mean        = mean,
+            std         = float(np.sqrt(max(total_sq / count - mean * mean, 0.0))),
+            percentiles = dict(zip((str(q) for q in self._stats_percentiles), np.percentile(np.concatenate(samples), self._stats_percentiles).tolist())),
+        )
+
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f'{cache_file}.{os.getpid()}'
+        with open(temp_file, 'w') as f:
+            json.dump(stats, f)
+        os.replace(temp_file, cache_file)
+        return stats
+
+    def get_stats(self):
+        """Intensity statistics of the dataset: min, max, mean, std and percentiles."""
+        return {k: self._stats[k] for k in ['min', 'max', 'mean', 'std', 'percentiles']}
 
     def __len__(self):
         return len(self._raw_idx)
 
     def __getitem__(self, idx):
+        if self._prefetcher is not None:
+            self._prefetcher.consumed(idx)
         inputfile = self.inputfiles[self._raw_idx[idx]]
-        image = self._load_files(inputfile)
-        self.update_minmax(image)
+        image = self._read_volume(inputfile)
         label = self._labels[idx] if self._labels is not None else -1
         return torch.tensor(image, dtype=torch.float32), torch.tensor(label, dtype=torch.int64)
 
+    def _read_volume(self, inputfile):
+        """
+        Decoded volume of `inputfile`, read through the volume cache: each file is decoded
+        once as long as it stays in the cache (or in spill_dir).
+        """
+        if self.cache_mb <= 0 and self.spill_dir is None:
+            return self._load_files(inputfile)
+        key = repr((type(self).__module__, type(self).__qualname__, os.path.abspath(inputfile), file_signature(inputfile)))
+        return _volume_cache.get(key, lambda: self._load_files(inputfile), spill_dir=self.spill_dir)
+
+    def prefetch(self, indices):
+        """
+        Decode the volumes of `indices` (the order in which they will be read) in a
+        background thread, up to read_ahead volumes ahead of the last one read.
+        Only useful when items are read in this process (DataLoader without workers).
+        """
+        self.stop_prefetch()
+        if self.read_ahead > 0 and (self.cache_mb > 0 or self.spill_dir is not None):
+            self._prefetcher = _Prefetcher(self, list(indices), self.read_ahead)
+
+    def stop_prefetch(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+
+    def __getstate__(self):
+        # The prefetch thread stays in this process.
+        state = self.__dict__.copy()
+        state['_prefetcher'] = None
+        return state
+
     def _get_raw_labels(self):
         if self._raw_labels is None:
             self._raw_labels = self._load_raw_labels() if self._use_labels else None
@@ -223,6 +627,10 @@ class BidsDataset(data.Dataset):
         label = self._get_raw_labels()[self._raw_idx[idx]]
         return label.copy()
 
+    def item_paths(self):
+        """Path of the file each item is decoded from, in dataset order."""
+        return [self.inputfiles[i] for i in self._raw_idx]
+
     @property
     def image_shape(self):
         return list(self._raw_shape[1:])
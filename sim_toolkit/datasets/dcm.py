@@ -2,12 +2,19 @@
 # SPDX-License-Identifier: NPOSL-3.0
 
 import os
+import json
+import atexit
+import hashlib
+import tempfile
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 from typing import Dict, List, Tuple
 
 import numpy as np
 from .base import BaseDataset
+from .. import dnnlib
+from .._utils import dataset_fingerprint, thread_map_ordered, default_num_threads
 
 class UserError(RuntimeError):
     """Compact, user-facing error (suppresses long trace)."""
@@ -29,6 +36,63 @@ def _require_pydicom():
         ) from None
 
 # -------- helpers --------
+def _dicom_meta(ds) -> dict:
+    """Tags used for filtering, grouping and sorting, as JSON-serializable values."""
+    ipp = getattr(ds, "ImagePositionPatient", None)
+    iop = getattr(ds, "ImageOrientationPatient", None)
+    instance = getattr(ds, "InstanceNumber", None)
+    slice_loc = getattr(ds, "SliceLocation", None)
+    return {
+        "SeriesInstanceUID": str(ds.SeriesInstanceUID) if getattr(ds, "SeriesInstanceUID", None) is not None else None,
+        "SOPInstanceUID": str(ds.SOPInstanceUID) if getattr(ds, "SOPInstanceUID", None) is not None else None,
+        "InstanceNumber": int(instance) if instance not in (None, "") else None,
+        "ImagePositionPatient": [float(v) for v in ipp] if ipp is not None else None,
+        "ImageOrientationPatient": [float(v) for v in iop] if iop is not None else None,
+        "SliceLocation": float(slice_loc) if slice_loc not in (None, "") else None,
+        "SeriesDescription": str(getattr(ds, "SeriesDescription", "") or "") or None,
+        "ImageType": [str(s).upper() for s in getattr(ds, "ImageType", [])],
+        "Rows": int(getattr(ds, "Rows", 0) or 0),
+        "Columns": int(getattr(ds, "Columns", 0) or 0),
+        "NumberOfFrames": int(getattr(ds, "NumberOfFrames", 1) or 1),
+        "SamplesPerPixel": int(getattr(ds, "SamplesPerPixel", 1) or 1),
+    }
+
+def _read_dicom_header(path: str) -> dict:
+    """Read the tags of a single DICOM file, without its pixel data."""
+    _require_pydicom()
+    import pydicom
+
+    ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+    meta = _dicom_meta(ds)
+    meta["TransferSyntaxUID"] = str(getattr(getattr(ds, "file_meta", None), "TransferSyntaxUID", "unknown"))
+    return meta
+
+def _dicom_index(path_data: str, paths: List[str], num_threads=None) -> List[dict]:
+    """
+    Header-only index of DICOM files: for each file in `paths`, its tags (see _dicom_meta)
+    or the reason it could not be read, under "error". Headers are read in parallel, and
+    the index is cached on a fingerprint of the dataset files.
+    """
+    rel_paths = [os.path.relpath(p, path_data) for p in paths]
+    key = repr(("dicom-index", os.path.abspath(path_data), hashlib.md5("\n".join(rel_paths).encode("utf-8")).hexdigest(), dataset_fingerprint(path_data)))
+    cache_file = dnnlib.make_cache_dir_path("dicom-index", hashlib.md5(key.encode("utf-8")).hexdigest() + ".json")
+    if os.path.isfile(cache_file):
+        with open(cache_file, "r") as f:
+            return json.load(f)
+
+    index = []
+    for (p, rel), meta, e in thread_map_ordered(lambda item: _read_dicom_header(item[0]), list(zip(paths, rel_paths)), num_threads):
+        if isinstance(e, MissingExtraError):
+            raise e
+        index.append(dict(meta, path=rel) if e is None else dict(path=rel, error=f"header-unreadable: {e.__class__.__name__}"))
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = f"{cache_file}.{os.getpid()}"
+    with open(temp_file, "w") as f:
+        json.dump(index, f)
+    os.replace(temp_file, cache_file)
+    return index
+
 def _read_dicom_pixel(path: str) -> Tuple[np.ndarray, dict]:
     """
     Read a single DICOM file and return (H, W) float32 pixel array plus selected tags.
@@ -60,18 +124,7 @@ def _read_dicom_pixel(path: str) -> Tuple[np.ndarray, dict]:
     if slope != 1.0 or inter != 0.0:
         arr = arr * slope + inter
 
-    # Collect a few tags used for grouping/sorting
-    meta = {
-        "SeriesInstanceUID": getattr(ds, "SeriesInstanceUID", None),
-        "SOPInstanceUID": getattr(ds, "SOPInstanceUID", None),
-        "InstanceNumber": getattr(ds, "InstanceNumber", None),
-        "ImagePositionPatient": getattr(ds, "ImagePositionPatient", None),
-        "ImageOrientationPatient": getattr(ds, "ImageOrientationPatient", None),
-        "SliceLocation": getattr(ds, "SliceLocation", None),
-        "SeriesDescription": getattr(ds, "SeriesDescription", None),
-        "ImageType": [s.upper() for s in getattr(ds, "ImageType", [])],
-    }
-    return arr, meta
+    return arr, _dicom_meta(ds)
 
 def _is_derived(meta: dict) -> bool:
     """Heuristic to skip derived/reformatted images."""
@@ -111,7 +164,9 @@ class DicomDataset2D(BaseDataset):
     """
     Loads ALL DICOM files from a folder (optionally recursive) as individual 2D images.
     Returns data with shape (N, C, H, W), where C is 1 (grayscale) or 3/4 (RGB/RGBA).
+    Headers are read first, so derived/localizer images are never decoded.
     """
+    _format_name = "DICOM"
 
     def __init__(self, path_data: str, recursive: bool = False, normalize: bool = False,
                  allow_derived: bool = False,  # new: optionally keep derived/localizer
@@ -129,7 +184,11 @@ class DicomDataset2D(BaseDataset):
             for p in glob(pattern, recursive=self.recursive):
                 yield p
 
-    def _load_files(self):
+    def _index_files(self):
+        """
+        Read the headers of all DICOM files, and return the files to decode:
+        single-frame images, without derived/localizer ones unless allow_derived=True.
+        """
         paths = sorted(set(self._iter_dicom_paths()))
         if not paths:
             raise DataLoadError(
@@ -137,53 +196,72 @@ class DicomDataset2D(BaseDataset):
                 f"(extensions: .dcm/.DCM/.dicom; recursive={self.recursive})."
             ) from None
 
-        images: List[np.ndarray] = []
-        bad: List[Tuple[str, str]] = []  # (path, reason)
-
-        for p in paths:
-            try:
-                arr, meta = _read_dicom_pixel(p)
-                if not self.allow_derived and _is_derived(meta):
-                    continue  # skip scouts/derived
-            except MissingExtraError as e:
-                raise e 
-            except Exception as e:
-                # Try to give a helpful Transfer Syntax hint
-                try:
-                    _require_pydicom()
-                    import pydicom
-                    ds_hdr = pydicom.dcmread(p, stop_before_pixels=True, force=True)
-                    ts = getattr(ds_hdr.file_meta, "TransferSyntaxUID", "unknown")
-                    bad.append((p, f"decode-failed (TransferSyntax={ts}): {e.__class__.__name__}"))
-                except Exception:
-                    bad.append((p, f"decode-failed: {e.__class__.__name__}"))
+        self._bad: List[Tuple[str, str]] = []  # (path, reason)
+        self._transfer_syntax: Dict[str, str] = {}
+        keep: List[str] = []
+        for entry in _dicom_index(self.path_data, paths, self.num_threads):
+            p = os.path.join(self.path_data, entry["path"])
+            if "error" in entry:
+                self._bad.append((p, entry["error"]))
                 continue
-
-            # Accept true 2D, RGB/RGBA, and CHW
-            if arr.ndim == 2:
-                chw = arr[None, ...]  # (1, H, W)
-            elif arr.ndim == 3:
-                # Color image? (H, W, C) with small C
-                if arr.shape[-1] in (3, 4):         # HWC -> CHW
-                    chw = np.moveaxis(arr, -1, 0)
-                elif arr.shape[0] in (3, 4) and arr.shape[1] > 8 and arr.shape[2] > 8:  # already CHW
-                    chw = arr
-                else:
-                    # Likely multi-frame (frames, H, W) or ambiguous 3D → direct the user to 3D loader
-                    bad.append((p, f"multi-frame or 3D shape {arr.shape} (use a 3D DICOM dataset)"))
-                    continue
-            else:
-                bad.append((p, f"unsupported shape {arr.shape}"))
+            if not self.allow_derived and _is_derived(entry):
+                continue  # skip scouts/derived
+            if entry["NumberOfFrames"] > 1:
+                self._bad.append((p, f"multi-frame ({entry['NumberOfFrames']} frames) (use a 3D DICOM dataset)"))
                 continue
+            self._transfer_syntax[p] = entry["TransferSyntaxUID"]
+            keep.append(p)
+        return keep
+
+    def _decode_item(self, p):
+        try:
+            arr, _ = _read_dicom_pixel(p)
+        except MissingExtraError:
+            raise
+        except Exception as e:
+            # Give a helpful Transfer Syntax hint
+            ts = self._transfer_syntax.get(p, "unknown")
+            raise DataLoadError(f"decode-failed (TransferSyntax={ts}): {e.__class__.__name__}") from None
+
+        # Accept true 2D, RGB/RGBA, and CHW
+        if arr.ndim == 2:
+            chw = arr[None, ...]  # (1, H, W)
+        elif arr.ndim == 3:
+            # Color image? (H, W, C) with small C
+            if arr.shape[-1] in (3, 4):         # HWC -> CHW
+                chw = np.moveaxis(arr, -1, 0)
+            elif arr.shape[0] in (3, 4) and arr.shape[1] > 8 and arr.shape[2] > 8:  # already CHW
+                chw = arr
+            else:
+                # Likely multi-frame (frames, H, W) or ambiguous 3D → direct the user to 3D loader
+                raise DataLoadError(f"multi-frame or 3D shape {arr.shape} (use a 3D DICOM dataset)") from None
+        else:
+            raise DataLoadError(f"unsupported shape {arr.shape}") from None
+
+        # Optional per-image min–max normalization to [0,1]
+        chw = chw.astype(np.float32, copy=False)
+        if self.normalize:
+            vmin, vmax = float(chw.min()), float(chw.max())
+            if vmax > vmin:
+                chw = (chw - vmin) / (vmax - vmin)
+        return chw
+
+    def _decode_params(self):
+        return dict(recursive=self.recursive, normalize=self.normalize, allow_derived=self.allow_derived)
 
-            # Optional per-image min–max normalization to [0,1]
-            chw = chw.astype(np.float32, copy=False)
-            if self.normalize:
-                vmin, vmax = float(chw.min()), float(chw.max())
-                if vmax > vmin:
-                    chw = (chw - vmin) / (vmax - vmin)
+    def _load_files(self):
+        paths = self._index_files()
 
+        images: List[np.ndarray] = []
+        loaded_paths: List[str] = []
+        for p, chw, e in thread_map_ordered(self._decode_item, paths, self.num_threads):
+            if isinstance(e, MissingExtraError):
+                raise e
+            if e is not None:
+                self._bad.append((p, str(e)))
+                continue
             images.append(chw)
+            loaded_paths.append(p)
 
         if not images:
             # Summarize why nothing was loaded and offer concrete fixes
@@ -206,6 +284,7 @@ class DicomDataset2D(BaseDataset):
             ) from None
 
         data = np.stack(images, axis=0).astype(np.float32, copy=False)  # (N, C, H, W)
+        self._item_paths = loaded_paths
         return data
 
     def _load_raw_labels(self):
@@ -214,6 +293,70 @@ class DicomDataset2D(BaseDataset):
 # ===============================
 #           3D DATASET
 # ===============================
+def _volumes_dir() -> str:
+    """
+    Directory of the memory-mapped stacks being assembled. Stacks left behind by
+    processes that no longer exist (e.g. killed runs) are removed.
+    """
+    import psutil
+
+    volumes_dir = dnnlib.make_cache_dir_path("dicom-volumes")
+    os.makedirs(volumes_dir, exist_ok=True)
+    for name in os.listdir(volumes_dir):
+        pid = name.split("-", 1)[0]
+        if pid.isdigit() and not psutil.pid_exists(int(pid)):
+            _remove_quietly(os.path.join(volumes_dir, name))
+    return volumes_dir
+
+def _remove_quietly(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
+
+def _assemble_series(out_file: str, out_shape: Tuple[int, ...], slot: int, slice_paths: List[str], normalize: bool):
+    """
+    Decode the sorted slices of one series, stack them into a (H, W, D) volume and write it
+    to `slot` of the (N, 1, H, W, D) float32 memory map `out_file`. Runs in a worker process,
+    so only one series per worker is held in memory.
+    Returns the volume shape (not written if it differs from out_shape), or None if the
+    series was skipped.
+    """
+    slices = []
+    for p in slice_paths:
+        try:
+            slices.append(_read_dicom_pixel(p)[0])
+        except MissingExtraError:
+            raise
+        except Exception:
+            continue  # Dropped slice
+    if len(slices) == 0:
+        return None
+
+    # Ensure all slices have same size
+    if len({sl.shape for sl in slices}) != 1:
+        # Skip inconsistent series
+        return None
+
+    vol = np.stack(slices, axis=-1).astype(np.float32, copy=False)  # (H, W, D)
+    del slices
+
+    if normalize:
+        vmin, vmax = float(vol.min()), float(vol.max())
+        if vmax > vmin:
+            vol = (vol - vmin) / (vmax - vmin)
+
+    if vol.shape != tuple(out_shape[2:]):
+        return vol.shape
+    out = np.memmap(out_file, dtype=np.float32, mode="r+", shape=tuple(out_shape))
+    out[slot, 0] = vol
+    out.flush()
+    del out
+    return vol.shape
+
 class DicomDataset3D(BaseDataset):
     """
     Groups .dcm files by SeriesInstanceUID into 3D volumes.
@@ -222,12 +365,16 @@ class DicomDataset3D(BaseDataset):
 
     Notes:
       - This class is folder-based (non-BIDS). If you have BIDS-wrapped DICOM (rare), use a dedicated indexer.
-      - We skip derived/localizer series by default (_is_derived).
+      - We skip derived/localizer series by default (_is_derived), based on the headers only:
+        their pixel data is never decoded.
     """
 
-    def __init__(self, path_data: str, recursive: bool = True, normalize: bool = False, **kwargs):
+    def __init__(self, path_data: str, recursive: bool = True, normalize: bool = False,
+                 num_processes: int = None,  # processes assembling series in parallel (None = min(8, #CPUs))
+                 **kwargs):
         self.recursive = recursive
         self.normalize = normalize
+        self.num_processes = num_processes
         super().__init__(path_data=path_data, **kwargs)
 
     def _load_files(self):
@@ -238,73 +385,76 @@ class DicomDataset3D(BaseDataset):
                 f"No DICOM files (.dcm) found in {os.path.abspath(self.path_data)}"
             ) from None
 
-        # 1) read all slices, bucket by SeriesInstanceUID
-        series_pixels: Dict[str, List[np.ndarray]] = defaultdict(list)
+        # 1) read the headers only, bucket by SeriesInstanceUID
         series_meta: Dict[str, List[dict]] = defaultdict(list)
-        dropped = 0
-
-        for p in paths:
-            try:
-                arr, meta = _read_dicom_pixel(p)
-            except Exception:
-                dropped += 1
+        for entry in _dicom_index(self.path_data, paths, self.num_threads):
+            sid = entry.get("SeriesInstanceUID")
+            if "error" in entry or sid is None:
                 continue
-
-            sid = meta.get("SeriesInstanceUID")
-            if sid is None:
-                dropped += 1
+            if _is_derived(entry):
                 continue
-            if _is_derived(meta):
-                continue
-
-            series_pixels[sid].append(arr)
-            series_meta[sid].append(meta)
+            series_meta[sid].append(entry)
 
-        if not series_pixels:
+        if not series_meta:
             raise DataLoadError(
                 "No valid DICOM series found (after filtering derived/localizer)."
             ) from None
 
-        # 2) sort and stack each series into (H, W, D)
-        volumes: List[np.ndarray] = []
-        for sid, slices in series_pixels.items():
-            metas = series_meta[sid]
-            order = _sort_slices(metas)
-
-            if len(order) != len(slices) or len(slices) == 0:
+        # 2) sort each series, skipping series whose slices differ in size
+        series_paths: Dict[str, List[str]] = {}
+        for sid, metas in series_meta.items():
+            if len({(m["Rows"], m["Columns"], m["SamplesPerPixel"]) for m in metas}) != 1:
                 continue
+            series_paths[sid] = [os.path.join(self.path_data, metas[i]["path"]) for i in _sort_slices(metas)]
 
-            sorted_slices = [slices[i] for i in order]
-
-            # Ensure all slices have same size
-            hs = {s.shape for s in sorted_slices}
-            if len(hs) != 1:
-                # Skip inconsistent series
-                continue
-
-            vol = np.stack(sorted_slices, axis=-1).astype(np.float32, copy=False)  # (H, W, D)
-
-            if self.normalize:
-                vmin, vmax = float(vol.min()), float(vol.max())
-                if vmax > vmin:
-                    vol = (vol - vmin) / (vmax - vmin)
-
-            volumes.append(vol[None, ...])  # (1, H, W, D)
-
-        if not volumes:
+        # 3) the volume shape (H, W, D) follows from the headers: preallocate the output
+        shapes = {(series_meta[sid][0]["Rows"], series_meta[sid][0]["Columns"], len(ps)) for sid, ps in series_paths.items()}
+        if not shapes:
             raise DataLoadError(
                 "No stackable DICOM series with consistent geometry."
             ) from None
-
-        # 3) ensure consistent spatial sizes across series (H, W, D)
-        shapes = {v.shape for v in volumes}
         if len(shapes) != 1:
             raise DataLoadError(
                 f"Inconsistent volume shapes across series: {sorted(shapes)}. "
                 "Please resample/crop to uniform (H,W,D)."
             ) from None
-
-        data = np.stack(volumes, axis=0).astype(np.float32, copy=False)  # (N, 1, H, W, D)
+        out_shape = (len(series_paths), 1) + shapes.pop()
+        fd, out_file = tempfile.mkstemp(prefix=f"{os.getpid()}-", suffix=".dat", dir=_volumes_dir())
+        os.close(fd)
+        try:
+            np.memmap(out_file, dtype=np.float32, mode="w+", shape=out_shape).flush()
+
+            # 4) decode, sort and stack each series directly into its slot, one series per process
+            tasks = [(out_file, out_shape, slot, ps, self.normalize) for slot, ps in enumerate(series_paths.values())]
+            num_processes = self.num_processes if self.num_processes is not None else default_num_threads()
+            if num_processes > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=min(num_processes, len(tasks))) as pool:
+                    results = list(pool.map(_assemble_series, *zip(*tasks)))
+            else:
+                results = [_assemble_series(*task) for task in tasks]
+
+            filled = [slot for slot, vol_shape in enumerate(results) if vol_shape is not None]
+            if not filled:
+                raise DataLoadError(
+                    "No stackable DICOM series with consistent geometry."
+                ) from None
+            bad_shapes = {vol_shape for vol_shape in results if vol_shape is not None and vol_shape != out_shape[2:]}
+            if bad_shapes:
+                raise DataLoadError(
+                    f"Inconsistent volume shapes across series: {sorted(bad_shapes | {out_shape[2:]})}. "
+                    "Please resample/crop to uniform (H,W,D)."
+                ) from None
+
+            data = np.memmap(out_file, dtype=np.float32, mode="r+", shape=out_shape)  # (N, 1, H, W, D)
+            if len(filled) < len(results):
+                data = np.ascontiguousarray(data[filled])
+            elif os.name == "nt":
+                data = np.array(data)  # A mapped file cannot be removed on Windows
+        finally:
+            # The memory map stays valid on POSIX systems. Where the file cannot be removed yet
+            # (still mapped after an error on Windows), it is removed at exit.
+            if not _remove_quietly(out_file):
+                atexit.register(_remove_quietly, out_file)
         return data
 
     def _load_raw_labels(self):
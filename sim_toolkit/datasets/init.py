@@ -9,6 +9,7 @@ from .png import PNGDataset
 from .tiff import TifDataset
 from .dcm import DicomDataset2D
 from .dcm import DicomDataset3D
+from .packed import PackedDataset, pack_dataset
 
 __all__ = [
     "BaseDataset",
@@ -19,5 +20,7 @@ __all__ = [
     "PNGDataset",
     "TifDataset",
     "DicomDataset2D",
-    "DicomDataset3D"
+    "DicomDataset3D",
+    "PackedDataset",
+    "pack_dataset",
     ]
@@ -16,45 +16,48 @@ def _require_pillow():
         ) from e
 
 class JPEGDataset(BaseDataset):
-    def _load_files(self):
+    _format_name = "JPEG"
+
+    def __init__(self,
+            path_data,              # Path to the dataset
+            draft_size=None,        # (optional) Decode at the smallest 1/2, 1/4 or 1/8 scale that is still at least draft_size x draft_size pixels.
+            **kwargs):
+        self.draft_size = draft_size
+        super().__init__(path_data, **kwargs)
+
+    def _index_files(self):
+        return sorted(glob(os.path.join(self.path_data, "*.jpg")) +
+                      glob(os.path.join(self.path_data, "*.jpeg")))
+
+    def _decode_item(self, path):
         """
-        Load a JPEG file and return a NumPy array.
-        Expects images to be in (N, C, H, W) format.
+        Load a JPEG file and return a NumPy array in (C, H, W) format.
+        With draft_size set, the image is downscaled in the DCT domain while decoding.
         """
         _require_pillow()
         from PIL import Image, ImageOps
-        
-        image_paths = sorted(glob(os.path.join(self.path_data, "*.jpg")) +
-                             glob(os.path.join(self.path_data, "*.jpeg")))
-        images = []
-
-        for path in image_paths:
-            try:
-                with Image.open(path) as img:
-                    img = ImageOps.exif_transpose(img) # Correct orientation
-
-                    # Convert to either grayscale or RGB
-                    if img.mode not in ["L", "RGB"]:
-                        img = img.convert("RGB")
 
-                    img_np = np.array(img)  # Shape: (H, W) or (H, W, C)
+        with Image.open(path) as img:
+            if self.draft_size is not None:
+                img.draft(None, (int(self.draft_size), int(self.draft_size)))
+            img = ImageOps.exif_transpose(img) # Correct orientation
 
-                    # Add channel dimension if grayscale
-                    if img_np.ndim == 2:
-                        img_np = img_np[np.newaxis, :, :]  # (1, H, W)
-                    elif img_np.ndim == 3:
-                        img_np = np.transpose(img_np, (2, 0, 1))  # (C, H, W)
+            # Convert to either grayscale or RGB
+            if img.mode not in ["L", "RGB"]:
+                img = img.convert("RGB")
 
-                    images.append(img_np)
-            except Exception as e:
-                print(f"Warning: Could not load {path}: {e}")
+            img_np = np.array(img)  # Shape: (H, W) or (H, W, C)
 
-        if not images:
-            raise RuntimeError(f"No JPEG images found in {self.path_data}")
+        # Add channel dimension if grayscale
+        if img_np.ndim == 2:
+            img_np = img_np[np.newaxis, :, :]  # (1, H, W)
+        elif img_np.ndim == 3:
+            img_np = np.transpose(img_np, (2, 0, 1))  # (C, H, W)
 
-        data = np.stack(images, axis=0)        # Shape: (N, C, H, W)
+        return img_np
 
-        return data  # [batch_size, n_channels, H, W]
+    def _decode_params(self):
+        return {} if self.draft_size is None else dict(draft_size=self.draft_size)
 
     def _load_raw_labels(self):
         pass
\ No newline at end of file
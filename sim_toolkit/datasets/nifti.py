@@ -17,95 +17,128 @@ def _require_nibabel():
         ) from e    
 
 class NiftiDataset2D(BaseDataset):
+    _format_name = "2D NIfTI"
+
     def _load_files(self):
         """
         Load 2D NIfTI data and return NumPy array in (N, C, H, W) format.
 
         - If `path_data` is a file (.nii / .nii.gz):
-            Assumes data stored as (W, H, C, N) and converts to (N, C, H, W).
+            Assumes data stored as (W, H, C, N) and converts to (N, C, H, W),
+            reading one image at a time (in float32) through nibabel's array proxy.
         - If `path_data` is a folder:
-            Loads all *.nii / *.nii.gz in the folder. Each file must contain a
-            single 2D image (H,W) or (H,W,C) with C in {1,3,4}. Stacks to (N,C,H,W).
+            Loads all *.nii / *.nii.gz in the folder (see _decode_item). Stacks to (N,C,H,W).
         """
-        _require_nibabel()
-        import nibabel as nib
-
         p = os.path.abspath(self.path_data)
 
         # --- Case A: single file ---
-        if os.path.isfile(p) and (p.endswith(".nii") or p.endswith(".nii.gz")):
-            data = nib.load(p)
-            data = np.asanyarray(data.dataobj) # numpy array of shape (W,H,C,N)
-            data = np.float64(data)
-
-            if data.ndim != 4:
-                raise RuntimeError(f"Expected a 4D NIfTI array shaped like (W,H,C,N); got shape {data.shape}.")
-            warn_once(f"Assuming NIfTI files stored as (W, H, C, N) format. Your data has shape: {data.shape}.",
-                      key="nifti2d.image_format")
-
-            # Swap axes to have the format (N,C,W,H)
-            data = np.swapaxes(data, 0,3)
-            data = np.swapaxes(data, 1,2)   # after swapping axes, array shape (N,C,H,W)
-
+        if self._is_single_file():
+            proxy = self._proxy()
+            n_items = proxy.shape[3]
+            data = np.empty((n_items,) + self._item_shape(proxy), dtype=np.float32)
+            for n in range(n_items):
+                data[n] = self._decode_item(n)
             return data # [batch_size, n_channels, img_resolution, img_resolution]
 
         # --- Case B: folder of files ---
         if os.path.isdir(p):
-            file_paths = sorted(
-                glob(os.path.join(p, "*.nii")) + glob(os.path.join(p, "*.nii.gz"))
-            )
-            if not file_paths:
-                raise RuntimeError(
-                    f"No NIfTI files (.nii/.nii.gz) found under directory: {p}"
-                )
-
-            images = []
-            bad = []
-
-            for fp in file_paths:
-                try:
-                    img = nib.load(fp)
-                    arr = np.asanyarray(img.dataobj)
-
-                    # Allow 2D or 2D+channels images only
-                    if arr.ndim == 4:
-                        # Many NIfTI files store (H,W,C,N) with N=1 for a single image.
-                        # Accept this special case and squeeze N if feasible.
-                        if arr.shape[-1] == 1 and arr.shape[2] in (1, 3, 4):
-                            arr = arr[..., 0]  # (H,W,C)
-                        else:
-                            raise ValueError(f"{os.path.basename(fp)}: 4D array {arr.shape} not supported for 2D dataset.")
-
-                    arr = arr.astype(np.float32, copy=False)
-                    chw = _to_chw(arr)  # (C,H,W)
-                    images.append(chw)
-                except Exception as e:
-                    bad.append((os.path.basename(fp), str(e)))
-
-            if not images:
-                lines = [f"No readable 2D NIfTI images loaded from {p}."]
-                if bad:
-                    lines.append("Some reasons:")
-                    for name, reason in bad[:5]:
-                        lines.append(f"  - {name}: {reason}")
-                raise RuntimeError("\n".join(lines))
-
-            # Ensure consistent (C,H,W)
-            shapes = {im.shape for im in images}
-            if len(shapes) != 1:
-                raise ValueError(
-                    f"Inconsistent image shapes in folder: {sorted(shapes)}. "
-                    "Please resample/crop to a uniform (C,H,W) shape."
-                )
-
-            data = np.stack(images, axis=0)  # (N,C,H,W)
-            return data
+            return super()._load_files()
 
         # --- Neither file nor folder ---
         raise RuntimeError(
             f"`path_data` must be a NIfTI file (.nii/.nii.gz) or a directory; got: {p}"
         )
 
+    def _is_single_file(self):
+        p = os.path.abspath(self.path_data)
+        return os.path.isfile(p) and (p.endswith(".nii") or p.endswith(".nii.gz"))
+
+    def _proxy(self):
+        """
+        Array proxy of a single-file dataset (memory-mapped for uncompressed .nii files).
+        The file is kept open, and reopened in each process (e.g. forked DataLoader workers).
+        """
+        if getattr(self, "_dataobj", None) is None or self._dataobj_pid != os.getpid():
+            _require_nibabel()
+            import nibabel as nib
+
+            dataobj = nib.load(os.path.abspath(self.path_data), keep_file_open=True).dataobj
+            if len(dataobj.shape) != 4:
+                raise RuntimeError(f"Expected a 4D NIfTI array shaped like (W,H,C,N); got shape {dataobj.shape}.")
+            warn_once(f"Assuming NIfTI files stored as (W, H, C, N) format. Your data has shape: {dataobj.shape}.",
+                      key="nifti2d.image_format")
+            self._dataobj = dataobj
+            self._dataobj_pid = os.getpid()
+        return self._dataobj
+
+    @staticmethod
+    def _item_shape(proxy):
+        W, H, C, _ = proxy.shape
+        return (C, H, W)
+
+    def __getstate__(self):
+        # The array proxy is reopened in each DataLoader worker.
+        state = self.__dict__.copy()
+        state["_dataobj"] = None
+        return state
+
+    def _index_files(self):
+        """
+        Files of a folder dataset (each holding a single 2D image); item indices for a single-file dataset.
+        """
+        p = os.path.abspath(self.path_data)
+        if self._is_single_file():
+            return list(range(self._proxy().shape[3]))
+        if not os.path.isdir(p):
+            return None
+        file_paths = sorted(
+            glob(os.path.join(p, "*.nii")) + glob(os.path.join(p, "*.nii.gz"))
+        )
+        if not file_paths:
+            raise RuntimeError(
+                f"No NIfTI files (.nii/.nii.gz) found under directory: {p}"
+            )
+        return file_paths
+
+    def item_paths(self):
+        return None if self._is_single_file() else super().item_paths()
+
+    def _decode_item(self, fp):
+        """
+        Load a NIfTI file holding a single 2D image (H,W) or (H,W,C) with C in {1,3,4}
+        and return a NumPy array in (C, H, W) format.
+        For a single-file dataset, `fp` is the index of the image to read from the (W,H,C,N) array.
+        """
+        if not isinstance(fp, str):
+            # (W,H,C) -> (C,H,W)
+            return np.asarray(self._proxy()[..., fp], dtype=np.float32).transpose(2, 1, 0)
+
+        _require_nibabel()
+        import nibabel as nib
+
+        img = nib.load(fp)
+        arr = np.asanyarray(img.dataobj)
+
+        # Allow 2D or 2D+channels images only
+        if arr.ndim == 4:
+            # Many NIfTI files store (H,W,C,N) with N=1 for a single image.
+            # Accept this special case and squeeze N if feasible.
+            if arr.shape[-1] == 1 and arr.shape[2] in (1, 3, 4):
+                arr = arr[..., 0]  # (H,W,C)
+            else:
+                raise ValueError(f"{os.path.basename(fp)}: 4D array {arr.shape} not supported for 2D dataset.")
+
+        arr = arr.astype(np.float32, copy=False)
+        return _to_chw(arr)  # (C,H,W)
+
+    def _no_images_error(self, failed):
+        lines = [f"No readable 2D NIfTI images loaded from {os.path.abspath(self.path_data)}."]
+        if failed:
+            lines.append("Some reasons:")
+            for fp, reason in failed[:5]:
+                lines.append(f"  - {os.path.basename(str(fp))}: {reason}")
+        return RuntimeError("\n".join(lines))
+
     def _load_raw_labels(self):
         pass
 
@@ -118,22 +151,28 @@ class NiftiDataset3D(BidsDataset):
         """
         _require_nibabel()
         import nibabel as nib
-        
-        data = nib.load(input).get_fdata()
-
-        data = np.rot90(data, k=3, axes=(0, 1))
-        data = np.rot90(data, k=1, axes=(0, 2))
-        data = np.rot90(data, k=1, axes=(1, 2))
 
-        data = np.expand_dims(data, axis=0)
+        # Read the volume a few slices at a time in float32, through the array proxy. The
+        # (X, Y, Z) -> (Z, Y, X) permutation with all axes flipped is the same orientation
+        # as rot90(k=3, axes=(0,1)), rot90(k=1, axes=(0,2)), rot90(k=1, axes=(1,2)).
+        proxy = nib.load(input, keep_file_open=True).dataobj
+        X, Y, Z = proxy.shape[:3]
+        perm = (2, 1, 0) + tuple(range(3, len(proxy.shape)))
+        data = np.empty((1, Z, Y, X) + tuple(proxy.shape[3:]), dtype=np.float32)
+        chunk = max(1, 2**22 * Z // int(np.prod(proxy.shape)))  # ~16 MB of float32 per read
+        for z0 in range(0, Z, chunk):
+            z1 = min(Z, z0 + chunk)
+            slab = np.asarray(proxy[:, :, z0:z1], dtype=np.float32)  # (X, Y, z1-z0, ...)
+            data[0, Z - z1:Z - z0] = slab.transpose(perm)[::-1, ::-1, ::-1]
 
         # Normalize to the range [0, 255]
         min_val = data.min()
         max_val = data.max()
-        data = (data - min_val) / (max_val - min_val)
+        data -= min_val
+        data /= max_val - min_val
         data *= 255
 
-        return data.copy() # [n_channels, img_resolution, img_resolution, img_resolution]
+        return data # [n_channels, img_resolution, img_resolution, img_resolution]
 
     def _load_raw_labels(self):
-        pass
\ No newline at end of file
+        pass
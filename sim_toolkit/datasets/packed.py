@@ -0,0 +1,217 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+"""
+Packed dataset format: any dataset converted once into fixed-dtype, memory-mappable
+.npy shards plus a JSON index holding the item shape, dtype, value range and labels.
+
+Pack a dataset from the command line:
+
+    python -m sim_toolkit.datasets.packed --dataset dcm --data-type 3D \\
+        --path-data /data/real_dicom --dest /data/real_packed
+
+and use it with real_dataset="packed", real_params={"path_data": "/data/real_packed"}.
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+
+from .base import BaseDataset
+from .._utils import thread_map_ordered
+
+__all__ = ["PackedDataset", "pack_dataset", "INDEX_FILE"]
+
+INDEX_FILE = "packed_index.json"
+_FORMAT = "sim_toolkit.packed"
+_VERSION = 1
+
+def is_packed_dataset(path):
+    return os.path.isfile(os.path.join(str(path), INDEX_FILE))
+
+def _read_index(path):
+    index_file = os.path.join(path, INDEX_FILE)
+    if not os.path.isfile(index_file):
+        raise RuntimeError(
+            f"No packed dataset found in {path} (missing {INDEX_FILE}). "
+            "Create one with: python -m sim_toolkit.datasets.packed --help"
+        )
+    with open(index_file, "r") as f:
+        index = json.load(f)
+    if index.get("format") != _FORMAT or index.get("version") != _VERSION:
+        raise RuntimeError(f"Unsupported packed dataset format in {index_file}: {index.get('format')} v{index.get('version')}")
+    return index
+
+#----------------------------------------------------------------------------
+
+def pack_dataset(
+    dataset,                # Dataset to pack (any BaseDataset/BidsDataset instance)
+    dest,                   # Output directory
+    shard_mb=1024,          # Approximate size of each shard, in MiB
+    num_threads=None,       # Threads used to read the dataset (None = min(8, #CPUs))
+    overwrite=False,        # Replace an existing packed dataset in dest?
+    source=None,            # (optional) Description of the source dataset, stored in the index
+    verbose=True,
+):
+    """
+    Write every item of `dataset` to fixed-dtype .npy shards in `dest`, followed by the index.
+    Items keep the dtype of the dataset (float64 is stored as float32, the precision
+    at which items are returned anyway). Returns the index.
+    """
+    if is_packed_dataset(dest):
+        if not overwrite:
+            raise RuntimeError(f"{dest} already contains a packed dataset; use overwrite=True to replace it.")
+        shutil.rmtree(dest)
+    os.makedirs(dest, exist_ok=True)
+
+    num_items = len(dataset)
+    if num_items == 0:
+        raise RuntimeError("Cannot pack an empty dataset.")
+    dtype = np.dtype(getattr(dataset, "_dtype", np.float32))
+    if dtype == np.float64:
+        dtype = np.dtype(np.float32)
+    shape = [int(s) for s in dataset[0][0].shape]
+    item_bytes = int(np.prod(shape)) * dtype.itemsize
+    items_per_shard = max(1, int(shard_mb * 2**20) // item_bytes)
+
+    has_labels = getattr(dataset, "_labels", None) is not None
+    labels = []
+    shards = []
+    shard = None
+    vmin, vmax = None, None
+    for idx, (image, label), e in thread_map_ordered(dataset.__getitem__, range(num_items), num_threads):
+        if e is not None:
+            raise RuntimeError(f"Could not read item {idx} of the dataset: {e}") from e
+        image = image.numpy()
+        if list(image.shape) != shape:
+            raise ValueError(f"Inconsistent item shapes: {tuple(shape)} and {image.shape} (item {idx}).")
+        if idx % items_per_shard == 0:
+            if shard is not None:
+                shard.flush()
+            count = min(items_per_shard, num_items - idx)
+            name = f"shard-{len(shards):05d}.npy"
+            shard = np.lib.format.open_memmap(os.path.join(dest, name), mode="w+", dtype=dtype, shape=(count, *shape))
+            shards.append(dict(file=name, num_items=count))
+        shard[idx % items_per_shard] = image
+        vmin = image.min() if vmin is None else min(vmin, image.min())
+        vmax = image.max() if vmax is None else max(vmax, image.max())
+        if has_labels:
+            labels.append(label.numpy())
+        if verbose and ((idx + 1) % 1000 == 0 or idx + 1 == num_items):
+            print(f"Packed {idx + 1}/{num_items} items")
+    shard.flush()
+    del shard
+
+    if has_labels:
+        np.save(os.path.join(dest, "labels.npy"), np.stack(labels))
+
+    index = dict(
+        format      = _FORMAT,
+        version     = _VERSION,
+        source      = source if source is not None else dict(class_name=f"{type(dataset).__module__}.{type(dataset).__name__}", path_data=getattr(dataset, "path_data", None)),
+        num_items   = num_items,
+        shape       = shape,
+        dtype       = dtype.str,
+        min         = dtype.type(vmin).item(),
+        max         = dtype.type(vmax).item(),
+        shards      = shards,
+        labels      = "labels.npy" if has_labels else None,
+    )
+    # Written last: a directory without index is an incomplete pack.
+    temp_file = os.path.join(dest, f"{INDEX_FILE}.{os.getpid()}")
+    with open(temp_file, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(temp_file, os.path.join(dest, INDEX_FILE))
+    return index
+
+#----------------------------------------------------------------------------
+
+class PackedDataset(BaseDataset):
+    """
+    Dataset created by pack_dataset(). Items are read from memory-mapped shards on access,
+    and the shape, dtype and value range come from the index, so opening is instant.
+    """
+    _format_name = "packed"
+
+    def __init__(self,
+            path_data,              # Directory created by pack_dataset()
+            path_labels=None,       # (optional) Path to the labels (default: labels stored in the pack)
+            **kwargs):
+        self._index = _read_index(path_data)
+        self._shard_arrays = None
+        counts = [s["num_items"] for s in self._index["shards"]]
+        self._shard_starts = np.cumsum([0] + counts[:-1])
+        if path_labels is None and self._index["labels"] is not None:
+            path_labels = os.path.join(path_data, self._index["labels"])
+        kwargs["lazy"] = True
+        super().__init__(path_data, path_labels=path_labels, **kwargs)
+
+    def __getstate__(self):
+        # Memory maps are reopened in each DataLoader worker instead of being pickled.
+        state = self.__dict__.copy()
+        state["_shard_arrays"] = None
+        return state
+
+    def _shards(self):
+        if self._shard_arrays is None:
+            self._shard_arrays = [np.load(os.path.join(self.path_data, s["file"]), mmap_mode="r") for s in self._index["shards"]]
+        return self._shard_arrays
+
+    def _index_files(self):
+        return list(range(self._index["num_items"]))
+
+    def _decode_item(self, idx):
+        shard = int(np.searchsorted(self._shard_starts, idx, side="right")) - 1
+        return np.array(self._shards()[shard][idx - self._shard_starts[shard]])
+
+    def _get_stats(self):
+        return dict(shape=self._index["shape"], dtype=self._index["dtype"], min=self._index["min"], max=self._index["max"], bad=[])
+
+    def item_paths(self):
+        return None
+
+    def _load_raw_labels(self):
+        return np.load(self.path_labels)
+
+#----------------------------------------------------------------------------
+
+def _pack_cli():
+    import click
+
+    @click.command()
+    @click.option('--dataset', help='Dataset to pack: "nifti", "dcm", "tiff", "jpeg", "png", "auto", a class or a .py file', default='auto', show_default=True)
+    @click.option('--data-type', help='Data type', type=click.Choice(['2D', '3D'], case_sensitive=False), default='2D', show_default=True)
+    @click.option('--path-data', help='Path to the dataset', required=True, metavar='PATH')
+    @click.option('--path-labels', help='Path to the labels', default=None, metavar='PATH')
+    @click.option('--params', help='Other dataset parameters, as JSON', default='{}', metavar='JSON')
+    @click.option('--dest', help='Output directory', required=True, metavar='DIR')
+    @click.option('--shard-mb', help='Approximate shard size in MiB', type=float, default=1024, show_default=True)
+    @click.option('--num-threads', help='Threads used to read the dataset', type=int, default=None)
+    @click.option('--overwrite', help='Replace an existing packed dataset', is_flag=True)
+    def pack(dataset, data_type, path_data, path_labels, params, dest, shard_mb, num_threads, overwrite):
+        """Pack a dataset into memory-mappable shards, to be loaded with dataset="packed".
+
+        Example:
+
+        \b
+        python -m sim_toolkit.datasets.packed --dataset nifti --data-type 3D \\
+            --path-data /data/bids --params '{"structure": "sub-*/anat/*_T1w.nii.gz"}' \\
+            --dest /data/bids_packed
+        """
+        from .. import dnnlib
+        from .._utils import _mk_dataset_kwargs
+
+        params = dict(json.loads(params), path_data=path_data, path_labels=path_labels, use_labels=path_labels is not None)
+        dataset_kwargs = _mk_dataset_kwargs(dataset, params, data_type=data_type)
+        print(f'Loading {dataset_kwargs.class_name} from "{path_data}"...')
+        ds = dnnlib.util.construct_class_by_name(**dataset_kwargs)
+        print(f'Packing {len(ds)} items to "{dest}"...')
+        pack_dataset(ds, dest, shard_mb=shard_mb, num_threads=num_threads, overwrite=overwrite,
+                     source=dict(dataset_kwargs, data_type=data_type))
+        print('Done.')
+
+    return pack
+
+if __name__ == "__main__":
+    _pack_cli()() # pylint: disable=no-value-for-parameter
@@ -12,48 +12,89 @@ def _require_pillow():
         from PIL import Image  # noqa: F401
     except Exception as e:
         raise RuntimeError(
-            "JPEG support requires 'Pillow'. Install with: pip install pillow"
+            "PNG support requires 'Pillow'. Install with: pip install pillow"
         ) from e
 
+def _pyspng():
+    try:
+        import pyspng
+        return pyspng
+    except Exception:
+        return None
+
+# PNG color types decoded by pyspng without any conversion, with their number of channels:
+# grayscale (0) and RGB (2). 16-bit images are decoded with an extra (opaque) alpha channel.
+_PYSPNG_CHANNELS = {0: 1, 2: 3}
+
+# 16-bit images are divided by this factor, so that they have the same 0-255 range as 8-bit ones
+# (the range expected by the feature extractors).
+_UINT16_SCALE = 257
+
 class PNGDataset(BaseDataset):
-    def _load_files(self):
+    _format_name = "PNG"
+
+    def _index_files(self):
+        return sorted(glob(os.path.join(self.path_data, "*.png")))
+
+    def _decode_item(self, path):
         """
-        Load a PNG file and return a NumPy array.
-        Expects images to be in (N, C, H, W) format.
+        Load a PNG file and return a NumPy array in (C, H, W) format.
+        8-bit and 16-bit grayscale/RGB files are decoded with pyspng, other files with PIL.
+        16-bit files are rescaled to [0, 255] and returned as float32, keeping their precision.
         """
-        _require_pillow()
-        from PIL import Image, ImageOps
-        
-        image_paths = sorted(glob(os.path.join(self.path_data, "*.png")))
-        images = []
+        with open(path, "rb") as f:
+            data = f.read()
+
+        img_np = None
+        spng = _pyspng()
+        if spng is not None and self._use_pyspng(data):
+            img_np = spng.load(data)  # Shape: (H, W) or (H, W, C)
+            if img_np.ndim == 3:
+                img_np = img_np[:, :, :_PYSPNG_CHANNELS[data[25]]]
+        if img_np is None:
+            img_np = self._decode_pil(path)
+        if img_np.dtype == np.uint16:
+            img_np = img_np.astype(np.float32) / np.float32(_UINT16_SCALE)
 
-        for path in image_paths:
-            try:
-                with Image.open(path) as img:
-                    img = ImageOps.exif_transpose(img) # Correct orientation
+        # Add channel dimension if grayscale
+        if img_np.ndim == 2:
+            img_np = img_np[np.newaxis, :, :]  # (1, H, W)
+        elif img_np.ndim == 3:
+            img_np = np.transpose(img_np, (2, 0, 1))  # (C, H, W)
 
-                    # Convert to either grayscale or RGB
-                    if img.mode not in ["L", "RGB"]:
-                        img = img.convert("RGB")
+        return img_np
 
-                    img_np = np.array(img)  # Shape: (H, W) or (H, W, C)
+    def _decode_params(self):
+        return dict(uint16_scale=_UINT16_SCALE)
 
-                    # Add channel dimension if grayscale
-                    if img_np.ndim == 2:
-                        img_np = img_np[np.newaxis, :, :]  # (1, H, W)
-                    elif img_np.ndim == 3:
-                        img_np = np.transpose(img_np, (2, 0, 1))  # (C, H, W)
+    @staticmethod
+    def _use_pyspng(data):
+        """
+        Whether pyspng decodes the file to the same image as PIL: a 8/16-bit grayscale or
+        RGB image, without transparency (tRNS) or orientation (eXIf) chunks.
+        """
+        if len(data) < 29 or data[:8] != b"\x89PNG\r\n\x1a\n" or data[12:16] != b"IHDR":
+            return False
+        bit_depth, color_type = data[24], data[25]
+        if color_type not in _PYSPNG_CHANNELS or bit_depth not in (8, 16):
+            return False
+        header = data[:data.find(b"IDAT")]
+        return b"tRNS" not in header and b"eXIf" not in header
 
-                    images.append(img_np)
-            except Exception as e:
-                print(f"Warning: Could not load {path}: {e}")
+    def _decode_pil(self, path):
+        _require_pillow()
+        from PIL import Image, ImageOps
 
-        if not images:
-            raise RuntimeError(f"No PNG images found in {self.path_data}")
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img) # Correct orientation
 
-        data = np.stack(images, axis=0)        # Shape: (N, C, H, W)
+            # Keep 16-bit grayscale (rescaled by the caller), convert anything else to either grayscale or RGB
+            if img.mode in ["I;16", "I;16B", "I;16L"]:
+                return np.array(img).astype(np.uint16)
+            if img.mode not in ["L", "RGB"]:
+                img = img.convert("RGB")
 
-        return data  # [batch_size, n_channels, H, W]
+            return np.array(img)  # Shape: (H, W) or (H, W, C)
 
     def _load_raw_labels(self):
         pass
@@ -16,32 +16,24 @@ def _require_opencv():
         ) from e
 
 class TifDataset(BaseDataset):
-    def _load_files(self):
+    _format_name = "TIFF"
+
+    def _index_files(self):
+        return sorted(glob(os.path.join(self.path_data, "*.tif")) + glob(os.path.join(self.path_data, "*.tiff")))
+
+    def _decode_item(self, path):
         """
-        Load all TIFF images from the directory and return a NumPy array.
-        Expects images to be in (N, C, H, W) format.
+        Load a TIFF image and return a NumPy array in (C, H, W) format.
         """
         _require_opencv()
         import cv2
 
-        image_paths = sorted(glob(os.path.join(self.path_data, "*.tif")) + glob(os.path.join(self.path_data, "*.tiff")))
-        images = []
-
-        for path in image_paths:
-            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-            if image is not None:
-                if len(image.shape) == 2:
-                    image = np.expand_dims(image, axis=-1)  # Ensure single-channel images have (H, W, 1)
-                images.append(image)
-            else:
-                print(f"Warning: Could not load {path}")
-
-        if not images:
-            raise RuntimeError(f"No TIFF images found in {self.path_data}")
-
-        data = np.stack(images, axis=0)  # Shape: (N, H, W, C)
-        data = np.moveaxis(data, -1, 1)  # Convert to (N, C, H, W) format
-        return data # [batch_size, n_channels, img_resolution, img_resolution]
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("OpenCV could not decode the file")
+        if len(image.shape) == 2:
+            image = np.expand_dims(image, axis=-1)  # Ensure single-channel images have (H, W, 1)
+        return np.moveaxis(image, -1, 0)  # Convert to (C, H, W) format
 
     def _load_raw_labels(self):
         pass
\ No newline at end of file
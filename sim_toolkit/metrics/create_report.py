@@ -232,7 +232,7 @@ def get_image_with_scaled_dimensions(path, max_width=None, max_height=None):
 
     return Image(path, width=new_width, height=new_height)
 
-def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
+def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path, dataset_registry=None):
     doc = SimpleDocTemplate(out_pdf_path, pagesize=letter)
     elements = []
     styles = getSampleStyleSheet()
@@ -321,13 +321,13 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
     )
     elements.append(closing_paragraph)
 
-    dataset = dnnlib.util.construct_class_by_name(**args.dataset_kwargs)
+    dataset = metric_utils.construct_dataset(args.dataset_kwargs, dataset_registry)
     num_real = len(dataset)
     if args.use_pretrained_generator:
         num_syn = args.num_gen
         phrase_gen = f"<b>{num_syn}</b> synthetic images generated by {args.network_path}"
     else:
-        dataset_s = dnnlib.util.construct_class_by_name(**args.dataset_synt_kwargs)
+        dataset_s = metric_utils.construct_dataset(args.dataset_synt_kwargs, dataset_registry)
         num_syn = len(dataset_s)
         phrase_gen = f"<b>{num_syn}</b> synthetic images from {args.dataset_synt_kwargs['path_data']}"
     
@@ -411,7 +411,7 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
     elements.append(intro_text)
 
     # Real images visualization
-    dataset_real = dnnlib.util.construct_class_by_name(**args.dataset_kwargs)
+    dataset_real = metric_utils.construct_dataset(args.dataset_kwargs, dataset_registry)
     if args.data_type.lower()=='2d':
         n, ch, w_r, h_r = dataset_real._raw_shape
         real_text = Paragraph(
@@ -464,7 +464,7 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
                 styles['BodyText']
                 )
     else:
-        dataset_synt = dnnlib.util.construct_class_by_name(**args.dataset_synt_kwargs)
+        dataset_synt = metric_utils.construct_dataset(args.dataset_synt_kwargs, dataset_registry)
         if args.data_type.lower()=='2d':
             n, ch, w_s, h_s = dataset_synt._raw_shape
             synt_text = Paragraph(
@@ -693,8 +693,8 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
         elements.append(subtitle_prdc)   
 
         if args.data_type.lower() == '2d':
-            embedder = "VGG-16 (from Tensorflow)"
-            link = "https://www.tensorflow.org/api_docs/python/tf/keras/applications/VGG16"
+            embedder = "VGG-16 (from torchvision)"
+            link = "https://pytorch.org/vision/stable/models/generated/torchvision.models.vgg16.html"
         elif args.data_type.lower() == '3d':
             embedder = "3D-ResNet"
             link = "https://github.com/Tencent/MedicalNet"
@@ -770,8 +770,8 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
         elements.append(subtitle_pr_auth)   
 
         if args.data_type.lower() == '2d':
-            embedder = "VGG-16 (from Tensorflow)"
-            link = "https://www.tensorflow.org/api_docs/python/tf/keras/applications/VGG16"
+            embedder = "VGG-16 (from torchvision)"
+            link = "https://pytorch.org/vision/stable/models/generated/torchvision.models.vgg16.html"
         elif args.data_type.lower() == '3d':
             embedder = "3D-ResNet"
             link = "https://github.com/Tencent/MedicalNet"
@@ -979,7 +979,7 @@ def save_metrics_to_pdf(args, metrics, metric_folder, out_pdf_path):
     doc.build(elements, onLaterPages=add_page_number, onFirstPage=add_page_number)
     print(f"Report successfully saved to {out_pdf_path}")
 
-def generate_metrics_report(args):
+def generate_metrics_report(args, dataset_registry=None):
     metric_folder = args.run_dir
 
     out_file_path = metric_folder+"/report_sim_toolkit.pdf"
@@ -993,7 +993,7 @@ def generate_metrics_report(args):
 
     print("Generating the report...")   
     plot_metrics_triangle(metrics, metric_folder)
-    save_metrics_to_pdf(args, metrics, metric_folder, out_file_path)
+    save_metrics_to_pdf(args, metrics, metric_folder, out_file_path, dataset_registry=dataset_registry)
 
 
 
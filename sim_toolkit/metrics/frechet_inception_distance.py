@@ -30,7 +30,7 @@ def compute_fid(opts, max_real, num_gen):
     detector_kwargs = dict(return_features=True) # Return raw features before the softmax layer.
 
     real_feature_stats = metric_utils.compute_feature_stats_for_dataset(
-        opts=opts, dataset=dnnlib.util.construct_class_by_name(**opts.dataset_kwargs),
+        opts=opts, dataset=metric_utils.construct_dataset(opts.dataset_kwargs, opts.dataset_registry),
         detector_url=detector_url, detector_kwargs=detector_kwargs,
         rel_lo=0, rel_hi=0, dataset_kwargs=opts.dataset_kwargs, capture_all=True, capture_mean_cov=True, max_items=max_real)
     real_features = real_feature_stats.get_all_torch().to(torch.float32).to(opts.device)
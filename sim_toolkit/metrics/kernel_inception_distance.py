@@ -27,7 +27,7 @@ def compute_kid(opts, max_real, num_gen, num_subsets, max_subset_size):
     detector_kwargs = dict(return_features=True) # Return raw features before the softmax layer.
 
     real_features = metric_utils.compute_feature_stats_for_dataset(
-        opts=opts, dataset=dnnlib.util.construct_class_by_name(**opts.dataset_kwargs), 
+        opts=opts, dataset=metric_utils.construct_dataset(opts.dataset_kwargs, opts.dataset_registry), 
         detector_url=detector_url, detector_kwargs=detector_kwargs,
         rel_lo=0, rel_hi=0, dataset_kwargs=opts.dataset_kwargs, capture_all=True, max_items=max_real).get_all()
 
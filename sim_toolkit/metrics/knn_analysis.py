@@ -45,7 +45,7 @@ def process_batches_and_find_closest(opts, real_embeddings_OC, detector_url, det
     OC_model.eval().to(opts.device)
 
     if not opts.use_pretrained_generator:
-        synt_dataset = dnnlib.util.construct_class_by_name(**opts.dataset_synt_kwargs)
+        synt_dataset = metric_utils.construct_dataset(opts.dataset_synt_kwargs, opts.dataset_registry)
         if num_gen is None:
             num_gen = len(synt_dataset)
 
@@ -92,14 +92,14 @@ def process_batches_and_find_closest(opts, real_embeddings_OC, detector_url, det
 def plot_knn(opts, max_real, num_gen, k=8, top_n=6):
     #detector_url = 'https://nvlabs-fi-cdn.nvidia.com/stylegan2-ada-pytorch/pretrained/metrics/inception-2015-12-05.pt'
     if opts.data_type.lower() == '2d':
-        detector_url = {'model': 'vgg16', 'randomise': False, 'dim64': False}
+        detector_url = ('https://download.pytorch.org/models/vgg16-397923af.pth', 'vgg16')
     elif opts.data_type.lower() == '3d':
         detector_url = ('https://zenodo.org/records/15234379/files/resnet_50_23dataset_cpu.pth?download=1', '3d')
     detector_kwargs = dict(return_features=True) # Return raw features before the softmax layer.
 
     # Step 1: Get embeddings for real images
     real_embeddings = metric_utils.compute_feature_stats_for_dataset(
-        opts=opts, dataset=dnnlib.util.construct_class_by_name(**opts.dataset_kwargs), 
+        opts=opts, dataset=metric_utils.construct_dataset(opts.dataset_kwargs, opts.dataset_registry), 
         detector_url=detector_url, detector_kwargs=detector_kwargs,
         rel_lo=0, rel_hi=0, dataset_kwargs=opts.dataset_kwargs, capture_all=True, max_items=max_real).get_all_torch().to(torch.float16).to(opts.device)
 
@@ -17,9 +17,18 @@ import hashlib
 import pickle
 import copy
 import uuid
+import json
+import shutil
+import weakref
+import platform
+import threading
+import queue
+import contextlib
+import psutil
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import inspect
 import re
 from pathlib import Path
@@ -42,14 +51,20 @@ from sklearn.manifold import TSNE
 
 from . import metric_main
 from .. import dnnlib
+from .._utils import dataset_fingerprint, file_signature
 from ..representations.OneClass import OneClassLayer
-from ..representations import resnet3d
+from ..representations import resnet3d, vgg16
 
 #----------------------------------------------------------------------------
 
+def resolve_batch_size(batch_size, default=64):
+    """Batch size used outside the detectors: batch_size="auto" only tunes the feature extraction."""
+    return default if batch_size == 'auto' else batch_size
+
 class MetricOptions:
-    def __init__(self, run_dir, batch_size, data_type, use_pretrained_generator, run_generator, network_pkl, num_gen, nhood_size, knn_config, padding, oc_detector_path, train_OC, cache, seed, comp_metrics, G=None, G_kwargs={}, dataset_kwargs={}, dataset_synt_kwargs={}, num_gpus=1, rank=0, device=None, progress=None):
+    def __init__(self, run_dir, batch_size, data_type, use_pretrained_generator, run_generator, network_pkl, num_gen, nhood_size, knn_config, padding, oc_detector_path, train_OC, cache, seed, comp_metrics, G=None, G_kwargs={}, dataset_kwargs={}, dataset_synt_kwargs={}, num_gpus=1, rank=0, device=None, progress=None, feature_store=None, dataset_registry=None, cache_content_hash=False, feature_spill_dir=None, num_workers=None, prefetch_factor=None, detector_precision='fp32', tile_size_3d=None, tile_overlap_3d=32):
         assert 0 <= rank <= num_gpus
+        assert detector_precision in ['fp32', 'bf16', 'int8']
         self.G              = G
         self.G_kwargs       = dnnlib.EasyDict(G_kwargs)
         self.dataset_kwargs = dnnlib.EasyDict(dataset_kwargs)
@@ -59,6 +74,7 @@ class MetricOptions:
         self.device         = device if device is not None else torch.device('cuda', rank)
         self.progress       = progress.sub() if progress is not None and rank == 0 else ProgressMonitor()
         self.cache          = cache
+        self.cache_content_hash = cache_content_hash
         self.run_dir        = run_dir
         self.gen_path       = network_pkl
         self.data_path      = dataset_kwargs.path_data
@@ -72,9 +88,18 @@ class MetricOptions:
         self.run_generator  = run_generator
         self.use_pretrained_generator = use_pretrained_generator
         self.data_type      = data_type
-        self.batch_size     = batch_size
+        self.auto_batch_size = (batch_size == 'auto')
+        self.batch_size     = resolve_batch_size(batch_size)
         self.seed           = seed
         self.comp_metrics   = comp_metrics
+        self.feature_store  = feature_store
+        self.dataset_registry = dataset_registry
+        self.feature_spill_dir = feature_spill_dir
+        self.num_workers    = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.detector_precision = detector_precision
+        self.tile_size_3d   = tile_size_3d
+        self.tile_overlap_3d = tile_overlap_3d
         self.OC_params  = dict({"rep_dim": 32, 
                     "num_layers": 3, 
                     "num_hidden": 128, 
@@ -93,43 +118,108 @@ class MetricOptions:
 #----------------------------------------------------------------------------
 
 _feature_detector_cache = dict()
-_feature_detector_3d_cache = dict()
+_pretrained_embedder_cache = dict()
 
 class ResNet3DEmbedder(nn.Module):
     def __init__(self, checkpoint_path, device):
         super().__init__()
         self.device = device
-        self._feature_output = None
         self.model = self._load_model(checkpoint_path)
-        self._register_hook()
 
     def _load_model(self, checkpoint_path):
         use_cuda = self.device == "cuda" and torch.cuda.is_available()
-        model = resnet3d.resnet50(
+        model = resnet3d.resnet50_features(
+            out_stage='layer4',
             shortcut_type='B',
             no_cuda=not use_cuda)
         checkpoint = torch.load(checkpoint_path, map_location='cpu')
         model.load_state_dict(checkpoint['state_dict'], strict=False)
         return model.to(self.device).eval()
 
-    def _register_hook(self):
-        def hook_fn(_, __, output):
-            self._feature_output = output.detach()
+    def _layer4(self, x):
+        with torch.no_grad():
+            return self.model(x)
+
+    def forward(self, x, tile_size=None, tile_overlap=32):
+        if tile_size is None:
+            # Global Average Pooling over 3D spatial dimensions
+            embedding = self._layer4(x).mean(dim=(-1, -2, -3))
+            return embedding
+        return self._tiled_forward(x, tile_size, tile_overlap)
+
+    # Total stride of the backbone up to layer4 (conv1, maxpool and layer2 halve the resolution).
+    stride = 8
+
+    def _tile_ranges(self, size, tile_size, tile_overlap):
+        """
+        Split one axis of length `size` into tiles of `tile_size` voxels overlapping by `tile_overlap`.
+        Returns (start, end, keep_lo, keep_hi) per tile, where [keep_lo, keep_hi) is the range of
+        layer4 voxels (in volume coordinates) assigned to the tile: the tiles share out the
+        layer4 output, each keeping the voxels farthest from its cut edges.
+        """
+        out_size = -(-size // self.stride)
+        step = tile_size - tile_overlap
+        # The last tile is shifted back to (at least) full size, staying aligned to the stride.
+        last = max(0, (size - tile_size) // self.stride * self.stride)
+        starts = [0]
+        while starts[-1] < last:
+            starts.append(min(starts[-1] + step, last))
+        ends = [min(start + tile_size, size) for start in starts[:-1]] + [size]
+        # Neighbouring tiles split their overlap in the middle.
+        bounds = [0] + [(starts[i] + ends[i - 1]) // 2 // self.stride for i in range(1, len(starts))] + [out_size]
+        return [(starts[i], ends[i], bounds[i], bounds[i + 1]) for i in range(len(starts))]
+
+    def _tiled_forward(self, x, tile_size, tile_overlap):
+        """
+        Average-pooled layer4 features computed from overlapping [tile_size]^3 patches, so that
+        peak memory depends on the tile size rather than on the volume size. Tile sizes are
+        rounded up to a multiple of the backbone stride and overlaps down to twice the stride.
+        The result equals forward() only if a tile covers the whole volume: the receptive field
+        of the dilated layer3/layer4 extends well beyond each tile (see the README for the drift).
+        """
+        tile_size = -(-tile_size // self.stride) * self.stride
+        tile_overlap = min(tile_overlap // (2 * self.stride) * (2 * self.stride), tile_size - self.stride)
+        ranges = [self._tile_ranges(size, tile_size, tile_overlap) for size in x.shape[2:]]
+        total = None
+        count = 0
+        for d0, d1, dlo, dhi in ranges[0]:
+            for h0, h1, hlo, hhi in ranges[1]:
+                for w0, w1, wlo, whi in ranges[2]:
+                    out = self._layer4(x[:, :, d0:d1, h0:h1, w0:w1])
+                    d, h, w = d0 // self.stride, h0 // self.stride, w0 // self.stride
+                    out = out[:, :, dlo - d:dhi - d, hlo - h:hhi - h, wlo - w:whi - w]
+                    tile_sum = out.float().sum(dim=(-1, -2, -3))
+                    total = tile_sum if total is None else total + tile_sum
+                    count += out.shape[2] * out.shape[3] * out.shape[4]
+        return total / count
+
+class VGG16Embedder(nn.Module):
+    """
+    VGG-16 pretrained on ImageNet (torchvision weights). Takes [N, C, 224, 224]
+    images in [0, 255] and returns the 4096-dimensional fc2 features.
+    """
+    def __init__(self, checkpoint_path, device):
+        super().__init__()
+        self.device = device
+        self.model = self._load_model(checkpoint_path)
+        self.register_buffer('mean', torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1) * 255)
+        self.register_buffer('std', torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1) * 255)
 
-        # Register hook on layer4 only once
-        self.model.layer4.register_forward_hook(hook_fn)
+    def _load_model(self, checkpoint_path):
+        model = vgg16.vgg16()
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
+        model.load_state_dict(checkpoint['state_dict'])
+        return model.to(self.device).eval()
 
-    def forward(self, x):
-        self._feature_output = None
+    def forward(self, x, return_features=True):
+        if x.shape[1] == 1:
+            x = x.repeat(1, 3, 1, 1)
+        x = (x.to(torch.float32) - self.mean) / self.std
         with torch.no_grad():
-            _ = self.model(x)
+            return self.model(x, return_features=return_features)
 
-        if self._feature_output is None:
-            raise RuntimeError("Feature hook did not capture output from layer4.")
-
-        # Global Average Pooling over 3D spatial dimensions
-        embedding = self._feature_output.mean(dim=(-1, -2, -3))
-        return embedding
+# Detectors loaded from a checkpoint (instead of a TorchScript pickle), by url[1]
+_pretrained_embedders = {'3d': ResNet3DEmbedder, 'vgg16': VGG16Embedder}
 
 def download_pretrained_model(url, destination_path):
     """Downloads a pre-trained model from a URL if it doesn't exist locally."""
@@ -153,21 +243,18 @@ def download_pretrained_model(url, destination_path):
 def get_feature_detector_name(url):
     """
     Function added to manage the different types of detectors:
-    - "url" is a string with the path to the detector (NVIDIA pretrained models)
-    - "url" is a dictionary with the model name (to exploit tf pretrained models)
+    - "url" is a tuple (url, '2d') with the path to a TorchScript detector (NVIDIA pretrained models)
+    - "url" is a tuple (url, '3d' | 'vgg16') with the path to the checkpoint of a pretrained embedder
     """
-    if type(url)== tuple:
-        detector_name = os.path.splitext(url[0].split('/')[-1])[0]
-    elif type(url)==dict:
-        detector_name = url['model']
+    detector_name = os.path.splitext(url[0].split('?')[0].split('/')[-1])[0]
     return detector_name
 
     
-def get_feature_detector(url, device=torch.device('cpu'), num_gpus=1, rank=0, verbose=False):
+def get_feature_detector(url, device=torch.device('cpu'), num_gpus=1, rank=0, verbose=False, precision='fp32'):
     assert 0 <= rank <= num_gpus
-    key = (url[0], device)
-    if type(url)== tuple and url[1] == '3d':
-        if key not in _feature_detector_3d_cache:
+    key = (url[0], device, precision)
+    if type(url)== tuple and url[1] in _pretrained_embedders:
+        if key not in _pretrained_embedder_cache:
             is_leader = (rank == 0)
             if not is_leader and num_gpus > 1:
                 torch.distributed.barrier() # leader goes first
@@ -178,34 +265,141 @@ def get_feature_detector(url, device=torch.device('cpu'), num_gpus=1, rank=0, ve
             filename = os.path.basename(url[0].split('?')[0])
             checkpoint_path = os.path.join(pretrained_dir, filename)
             download_pretrained_model(url[0], checkpoint_path)
-            model = ResNet3DEmbedder(checkpoint_path, device).eval().to(device)
-            _feature_detector_3d_cache[key] = model
+            model = _pretrained_embedders[url[1]](checkpoint_path, device).eval().to(device)
+            model = prepare_detector(model, precision, device, verbose=(verbose and is_leader))
+            _pretrained_embedder_cache[key] = model
             if is_leader and num_gpus > 1:
                 torch.distributed.barrier() # others follow
-        return _feature_detector_3d_cache[key]        
+        return _pretrained_embedder_cache[key]        
     else:
         if key not in _feature_detector_cache:
             is_leader = (rank == 0)
             if not is_leader and num_gpus > 1:
                 torch.distributed.barrier() # leader goes first
             with dnnlib.util.open_url(url[0], verbose=(verbose and is_leader)) as f:
-                _feature_detector_cache[key] = torch.jit.load(f).eval().to(device)
+                _feature_detector_cache[key] = prepare_detector(torch.jit.load(f).eval().to(device), precision, device, verbose=(verbose and is_leader))
             if is_leader and num_gpus > 1:
                 torch.distributed.barrier() # others follow
     return _feature_detector_cache[key]
 
+def prepare_detector(detector, precision, device, verbose=False):
+    """
+    Adapt a feature detector to the requested precision:
+    - 'fp32': unchanged.
+    - 'bf16': channels_last weights; extract_features_from_detector() runs it under bfloat16 autocast.
+    - 'int8': dynamic int8 quantization of the nn.Linear layers (CPU only). Falls back to fp32 for
+      TorchScript detectors and for detectors without fully-connected layers (e.g. the 3D ResNet).
+    """
+    if precision == 'int8':
+        has_linear = not isinstance(detector, torch.jit.ScriptModule) and any(isinstance(m, nn.Linear) for m in detector.modules())
+        if torch.device(device).type != 'cpu' or not has_linear:
+            warnings.warn(f"detector_precision='int8' is not applicable to {type(detector).__name__} on {device}; using fp32 for this detector.")
+            return detector
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            detector = torch.ao.quantization.quantize_dynamic(detector, {nn.Linear}, dtype=torch.qint8)
+    if precision in ['bf16', 'int8']:
+        is_3d = any(isinstance(m, nn.Conv3d) for m in detector.modules())
+        detector = detector.to(memory_format=torch.channels_last_3d if is_3d else torch.channels_last)
+    if verbose and precision != 'fp32':
+        print(f'Running {type(detector).__name__} with detector_precision={precision!r}')
+    return detector
+
+def detector_inference(opts):
+    """Context for running feature detectors at opts.detector_precision."""
+    ctx = contextlib.ExitStack()
+    ctx.enter_context(torch.inference_mode())
+    if opts.detector_precision == 'bf16':
+        ctx.enter_context(torch.autocast(device_type=torch.device(opts.device).type, dtype=torch.bfloat16))
+    return ctx
+
+def to_channels_last(opts, images):
+    if opts.detector_precision == 'fp32':
+        return images
+    if images.ndim == 4:
+        return images.contiguous(memory_format=torch.channels_last)
+    if images.ndim == 5:
+        return images.contiguous(memory_format=torch.channels_last_3d)
+    return images
+
 #----------------------------------------------------------------------------
+# On-disk feature cache. Each entry is a directory holding:
+#   meta.json     format version and metadata
+#   features.npy  float32 feature matrix, opened with np.memmap when loaded
+#   mean_cov.npz  float64 sums of the features and of their outer products
+
+_FEATURE_CACHE_VERSION = 1
+
+def write_cache_dir(cache_dir, write_fn):
+    """Call write_fn(temp_dir), then atomically swap temp_dir in place of cache_dir."""
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    temp_dir = cache_dir + '.' + uuid.uuid4().hex
+    os.makedirs(temp_dir)
+    try:
+        write_fn(temp_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    if os.path.isdir(cache_dir):
+        old_dir = cache_dir + '.' + uuid.uuid4().hex
+        os.replace(cache_dir, old_dir)
+        os.replace(temp_dir, cache_dir)
+        shutil.rmtree(old_dir, ignore_errors=True) # Readers keep their memmaps valid (POSIX).
+    else:
+        os.replace(temp_dir, cache_dir)
+
+def write_cache_meta(cache_dir, **meta):
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump(dict(version=_FEATURE_CACHE_VERSION, **meta), f)
+
+def read_cache_meta(cache_dir):
+    """Return the metadata of a cache entry, or None if it is missing or has an unsupported version."""
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == _FEATURE_CACHE_VERSION else None
+
+def accumulate_mean_cov(raw_mean, raw_cov, x, sign=1, chunk_size=4096):
+    """Add (sign=1) or remove (sign=-1) the rows of `x` from the mean/cov sums, in place."""
+    for start in range(0, x.shape[0], chunk_size):
+        x64 = x[start:start + chunk_size].astype(np.float64)
+        raw_mean += sign * x64.sum(axis=0)
+        raw_cov += sign * (x64.T @ x64)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def alloc_features(num_items, num_features, spill_dir=None):
+    """
+    Allocate a float32 [num_items, num_features] feature matrix: in RAM, or as a
+    temporary memory-mapped file under `spill_dir`, removed once no view of it
+    is left.
+    """
+    if spill_dir is None:
+        return np.empty([num_items, num_features], dtype=np.float32)
+    os.makedirs(spill_dir, exist_ok=True)
+    path = os.path.join(spill_dir, f'features-{uuid.uuid4().hex}.npy')
+    buffer = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(num_items, num_features))
+    weakref.finalize(buffer, _remove_quietly, path)
+    return buffer
 
 class FeatureStats:
-    def __init__(self, capture_all=False, capture_mean_cov=False, max_items=None):
+    def __init__(self, capture_all=False, capture_mean_cov=False, max_items=None, spill_dir=None):
         self.capture_all = capture_all
         self.capture_mean_cov = capture_mean_cov
         self.max_items = max_items
+        self.spill_dir = spill_dir if max_items is not None else None # Out-of-core mode needs a known size.
         self.num_items = 0
         self.num_features = None
         self.all_features = None
         self.raw_mean = None
         self.raw_cov = None
+        self._buffer = None
 
     def set_num_features(self, num_features):
         if self.num_features is not None:
@@ -213,6 +407,10 @@ class FeatureStats:
         else:
             self.num_features = num_features
             self.all_features = []
+            if self.capture_all and self.spill_dir is not None:
+                # Out-of-core mode: batches are written into a preallocated memory-mapped buffer.
+                self._buffer = alloc_features(self.max_items, num_features, self.spill_dir)
+                self.all_features = [self._buffer[:0]]
             self.raw_mean = np.zeros([num_features], dtype=np.float64)
             self.raw_cov = np.zeros([num_features, num_features], dtype=np.float64)
 
@@ -228,9 +426,12 @@ class FeatureStats:
             x = x[:self.max_items - self.num_items]
 
         self.set_num_features(x.shape[1])
-        self.num_items += x.shape[0]
-        if self.capture_all:
+        if self.capture_all and self._buffer is not None:
+            self._buffer[self.num_items : self.num_items + x.shape[0]] = x
+            self.all_features = [self._buffer[:self.num_items + x.shape[0]]]
+        elif self.capture_all:
             self.all_features.append(x)
+        self.num_items += x.shape[0]
         if self.capture_mean_cov:
             x64 = x.astype(np.float64)
             self.raw_mean += x64.sum(axis=0)
@@ -250,10 +451,22 @@ class FeatureStats:
 
     def get_all(self):
         assert self.capture_all
-        return np.concatenate(self.all_features, axis=0)
+        if len(self.all_features) != 1:
+            # Keep the concatenated array, so that later calls are zero-copy.
+            self.all_features = [np.concatenate(self.all_features, axis=0)]
+        return self.all_features[0]
+
+    def iter_chunks(self, chunk_size=4096):
+        """Iterate over the captured features in [chunk_size, num_features] slices, without concatenating them."""
+        assert self.capture_all
+        for x in self.all_features:
+            for start in range(0, x.shape[0], chunk_size):
+                yield x[start:start + chunk_size]
 
     def get_all_torch(self):
-        return torch.from_numpy(self.get_all())
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='The given NumPy array is not writable') # Memory-mapped cache.
+            return torch.from_numpy(self.get_all())
 
     def get_mean_cov(self):
         assert self.capture_mean_cov
@@ -262,20 +475,142 @@ class FeatureStats:
         cov = cov - np.outer(mean, mean)
         return mean, cov
 
-    def save(self, pkl_file):
-        with open(pkl_file, 'wb') as f:
-            pickle.dump(self.__dict__, f)
+    def fill_mean_cov(self, chunk_size=4096):
+        # Derive the mean/cov sums from the captured features, so that stats
+        # extracted without capture_mean_cov can still serve e.g. FID.
+        if self.capture_mean_cov:
+            return
+        assert self.capture_all
+        self.raw_mean = np.zeros([self.num_features], dtype=np.float64)
+        self.raw_cov = np.zeros([self.num_features, self.num_features], dtype=np.float64)
+        for x in self.iter_chunks(chunk_size):
+            accumulate_mean_cov(self.raw_mean, self.raw_cov, x, chunk_size=chunk_size)
+        self.capture_mean_cov = True
+
+    def save(self, cache_dir):
+        def write(temp_dir):
+            write_cache_meta(temp_dir, capture_all=self.capture_all, capture_mean_cov=self.capture_mean_cov,
+                             max_items=self.max_items, num_items=self.num_items, num_features=self.num_features)
+            if self.capture_all and self.num_features is not None:
+                np.save(os.path.join(temp_dir, 'features.npy'), self.get_all())
+            if self.capture_mean_cov and self.num_features is not None:
+                np.savez(os.path.join(temp_dir, 'mean_cov.npz'), raw_mean=self.raw_mean, raw_cov=self.raw_cov)
+        write_cache_dir(cache_dir, write)
 
     @staticmethod
-    def load(pkl_file):
-        with open(pkl_file, 'rb') as f:
-            s = dnnlib.EasyDict(pickle.load(f))
-        obj = FeatureStats(capture_all=s.capture_all, max_items=s.max_items)
-        obj.__dict__.update(s)
+    def load(cache_dir):
+        meta = read_cache_meta(cache_dir)
+        if meta is None:
+            raise ValueError(f'No feature stats with version {_FEATURE_CACHE_VERSION} in {cache_dir}')
+        obj = FeatureStats(capture_all=meta['capture_all'], capture_mean_cov=meta['capture_mean_cov'], max_items=meta['max_items'])
+        if meta['num_features'] is not None:
+            obj.set_num_features(meta['num_features'])
+            obj.num_items = meta['num_items']
+            if obj.capture_all:
+                obj.all_features = [np.load(os.path.join(cache_dir, 'features.npy'), mmap_mode='r')]
+            if obj.capture_mean_cov:
+                with np.load(os.path.join(cache_dir, 'mean_cov.npz')) as f:
+                    obj.raw_mean, obj.raw_cov = f['raw_mean'], f['raw_cov']
         return obj
 
 #----------------------------------------------------------------------------
 
+class FeatureStore:
+    """
+    Run-scoped, in-memory store of extracted features.
+
+    Owned by the worker process of a run and shared by all the metrics it
+    computes, so that each (dataset, detector, preprocessing) tuple is embedded
+    only once per run. Stored entries always capture all the features; the
+    mean/cov sums are derived on demand.
+    """
+    def __init__(self):
+        self._stats = dict()
+
+    @staticmethod
+    def make_key(opts, source, detector_url, detector_kwargs, max_items):
+        source = repr(sorted(source.items())) if isinstance(source, dict) else repr(source)
+        return (
+            source,
+            repr(sorted(detector_url.items())) if isinstance(detector_url, dict) else repr(detector_url),
+            repr(sorted((detector_kwargs or {}).items())),
+            opts.data_type.lower(),
+            bool(opts.padding),
+            opts.detector_precision,
+            (opts.tile_size_3d, opts.tile_overlap_3d),
+            max_items,
+        )
+
+    def get(self, key, capture_all=False, capture_mean_cov=False, **_stats_kwargs):
+        stats = self._stats.get(key)
+        if stats is None:
+            return None
+        if capture_mean_cov:
+            stats.fill_mean_cov()
+        return stats
+
+    def put(self, key, stats):
+        assert stats.capture_all
+        self._stats[key] = stats
+
+    def __contains__(self, key):
+        return key in self._stats
+
+    def __len__(self):
+        return len(self._stats)
+
+#----------------------------------------------------------------------------
+
+class DatasetRegistry:
+    """
+    Run-scoped registry of dataset instances.
+
+    Each dataset is constructed once per run, the first time its kwargs are
+    requested, and the same instance is then shared by the image grids, every
+    metric and the final report. Callers must treat the datasets as read-only.
+
+    With shard=(rank, world_size), datasets are built with that shard spec, so that
+    each rank only loads in memory the items it embeds (see get_item_subset()).
+    The shard is not part of the key, nor of the dataset kwargs used by the caches.
+    """
+    def __init__(self, shard=None):
+        self.shard = shard
+        self._datasets = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(dataset_kwargs):
+        kwargs = dict(dataset_kwargs)
+        for name in ['path_data', 'path_labels']:
+            if kwargs.get(name) is not None:
+                kwargs[name] = os.path.abspath(os.path.expanduser(str(kwargs[name])))
+        return json.dumps(kwargs, sort_keys=True, default=repr)
+
+    def get(self, dataset_kwargs):
+        key = self.make_key(dataset_kwargs)
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is None:
+                if self.shard is not None:
+                    dataset_kwargs = dict(dataset_kwargs, shard=self.shard)
+                dataset = dnnlib.util.construct_class_by_name(**dataset_kwargs)
+                self._datasets[key] = dataset
+        return dataset
+
+    def __contains__(self, dataset_kwargs):
+        return self.make_key(dataset_kwargs) in self._datasets
+
+    def __len__(self):
+        return len(self._datasets)
+
+def construct_dataset(dataset_kwargs, registry=None):
+    """Return the dataset for dataset_kwargs, shared through the registry if given."""
+    if registry is None:
+        return dnnlib.util.construct_class_by_name(**dataset_kwargs)
+    return registry.get(dataset_kwargs)
+
+#----------------------------------------------------------------------------
+
 class ProgressMonitor:
     def __init__(self, tag=None, num_items=None, flush_interval=1000, verbose=False, progress_fn=None, pfn_lo=0, pfn_hi=1000, pfn_total=1000):
         self.tag = tag
@@ -480,6 +815,67 @@ def seed_worker(worker_id):
     np.random.seed(worker_seed)
     random.seed(worker_seed)
 
+def get_data_loader_kwargs(opts, dataset):
+    """
+    DataLoader settings from opts. With num_workers=None, datasets that decode
+    items on access get one worker per available core (split across ranks, at
+    most 8), while in-memory datasets stay in the main process: with the
+    'spawn' start method each worker would receive a pickled copy of the data.
+    Datasets with a volume cache (BidsDataset with cache_mb > 0) also stay in the
+    main process, where the cache outlives the pass and prefetch() reads ahead:
+    spawned workers would each start from an empty cache, on every pass.
+    """
+    num_workers = opts.num_workers
+    if num_workers is None:
+        in_memory = getattr(dataset, '_data', None) is not None or getattr(dataset, '_shard_items', None) is not None
+        in_memory = in_memory or getattr(dataset, 'cache_mb', 0) > 0
+        num_workers = 0 if in_memory else max(0, min(8, (os.cpu_count() or 1) // max(1, opts.num_gpus) - 1))
+    kwargs = dict(pin_memory=(torch.device(opts.device).type == 'cuda'), num_workers=num_workers)
+    if num_workers > 0 and opts.prefetch_factor is not None:
+        kwargs.update(prefetch_factor=opts.prefetch_factor)
+    return kwargs
+
+def prefetch(iterable, fn=None, depth=2):
+    """
+    Iterate over `iterable` (applying `fn` to each item) in a background thread,
+    keeping up to `depth` items ready ahead of the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item if fn is None else fn(item)):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
 def get_unique_filename(base_figname):
     """
     Check if a file already exists. If so, add a suffix to create a unique filename.
@@ -631,19 +1027,21 @@ def setup_snapshot_image_grid(dataset, grid_size, random_seed=0):
     return np.stack(images), np.stack(labels)
 
 def setup_grid_generated(args, G, labels, grid_size, num_images, real_dataset, device):
+    batch_size = resolve_batch_size(args.batch_size)
+
     # Latent vectors
     grid_z = torch.randn([labels.shape[0], *(G.z_dim if isinstance(G.z_dim, (list, tuple)) else [G.z_dim])], device=device)
     grid_c = torch.from_numpy(labels).to(device) if real_dataset._use_labels else None
 
     # Batching
-    num_batches = (num_images + args.batch_size - 1) // args.batch_size
+    num_batches = (num_images + batch_size - 1) // batch_size
     print(f"Generating a grid of {grid_size[0]} x {grid_size[1]} synthetic images...")
     
     image_tensors = []
     with torch.no_grad():
         for i in tqdm(range(num_batches)):
-            start = i * args.batch_size
-            end = min(start + args.batch_size, num_images)
+            start = i * batch_size
+            end = min(start + batch_size, num_images)
 
             z_batch = grid_z[start:end]
             if grid_c is not None:
@@ -685,100 +1083,206 @@ def plot_image_grid(args, img, drange, grid_size, group, rank=0, verbose=True):
     if rank == 0 and verbose:
         print(f"Saved grid of {group} samples in {save_path}")
 
-def reset_weights(model):
-    for layer in model.layers: 
-        import tensorflow as tf
-        if isinstance(layer, tf.keras.Model):
-            reset_weights(layer)
-            continue
-    for k, initializer in layer.__dict__.items():
-        if "initializer" not in k:
-            continue
-      # find the corresponding variable
-        var = getattr(layer, k.replace("_initializer", ""))
-        var.assign(initializer(var.shape, var.dtype))
-    return model
-
-def remove_layer(model):
-        from tensorflow.keras.models import Model
-        new_input = model.input
-        hidden_layer = model.layers[-2].output
-        return Model(new_input, hidden_layer)   
-
-def load_embedder(embedding):
+def resize_batch(batch, size):
     """
-    Load embedder to compute density and coverage metrics
+    Resize a [N, C, H, W] uint8 batch to [N, C, size, size] in one call.
+    Like PIL's Image.BICUBIC, the antialiased bicubic filter is applied along the
+    width first and the result is rounded to uint8 between the two passes; the
+    output matches the per-image PIL resize within 2 grey levels (on a small
+    fraction of pixels, due to PIL's fixed-point coefficients).
     """
-    import tensorflow as tf
-    from tensorflow.keras.models import Model
-    if embedding['model'] == 'vgg16' or embedding['model'] == 'vgg':
-        model = tf.keras.applications.VGG16(include_top = True, weights='imagenet')
-        model = remove_layer(model)
-        model.trainable = False
-          
-    elif embedding['model'] == 'inceptionv3' or embedding['model'] == 'inception':
-        model = tf.keras.applications.InceptionV3(include_top = True, weights='imagenet')
-        model = remove_layer(model)
-        model.trainable = False
-    
-    if embedding['randomise']:
-        model = reset_weights(model)
-        if embedding['dim64']:
-            # removes last layer and inserts 64 output
-            model = remove_layer(model)
-            new_input = model.input
-            hidden_layer = tf.keras.layers.Dense(64)(model.layers[-2].output)
-            model = Model(new_input, hidden_layer)   
-    model.run_eagerly = True
-    return model
- 
-def adjust_size_embedder(opts, embedder, embedding, batch):
-    
-    if embedding['model'] == 'vgg16' or embedding['model'] == 'vgg':
-        input_shape = 224
-    elif embedder.input.shape[2]==299:
-        input_shape = 299
-
-    # Adjust input shape from [N, C, H, W] to [N, W, H, C]
+    n, c, h, w = batch.shape
+    batch = batch.float()
+    if w != size:
+        batch = F.interpolate(batch, size=(h, size), mode='bicubic', antialias=True, align_corners=False).round().clamp(0, 255)
+    if h != size:
+        batch = F.interpolate(batch, size=(size, size), mode='bicubic', antialias=True, align_corners=False).round().clamp(0, 255)
+    return batch.to(torch.uint8)
+
+def pad_batch(batch, size):
+    """Zero-pad a [N, C, H, W] batch to [N, C, size, size], keeping the image centered."""
+    pad_height = size - batch.shape[2]
+    pad_width = size - batch.shape[3]
+    return F.pad(batch, (pad_width // 2, pad_width - pad_width // 2, pad_height // 2, pad_height - pad_height // 2))
+
+def adjust_size_embedder(opts, batch, input_shape=224):
+    """Resize (or zero-pad, if opts.padding) a [N, C, H, W] batch to the input size of the embedder."""
     n,c,h,w = batch.shape
-    batch = batch.permute(0, 2, 3, 1)
-    if c==1:
-        batch = batch.repeat(1, 1, 1, 3)
-
-    # Desired output shape
-    output_shape = (None, input_shape, input_shape, 3)
+    if batch.dtype != torch.uint8:
+        batch = batch.clamp(0, 255).to(torch.uint8)
 
     if opts.padding and (h<input_shape or w<input_shape):
-        batch = pad_image(batch.cpu(), output_shape)
-    else:
-        # Resize the image
-        resized_batch = []
-        for img in batch:
-            pil_img = Image.fromarray((img.cpu().numpy()).astype(np.uint8))
-            resized_img = pil_img.resize((input_shape, input_shape), resample=Image.BICUBIC) 
-            resized_batch.append(np.array(resized_img))
-        batch = np.array(resized_batch)
-
-    return batch
+        return pad_batch(batch, input_shape)
+    return resize_batch(batch, input_shape)
 
 def extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs):
-    if type(detector_url)==dict:
-        images = adjust_size_embedder(opts, detector, detector_url, images)
-        features = detector(images)                                   # tf.EagerTensor
-        features = torch.from_numpy(features.numpy()).to(opts.device) # torch.Tensor
-    elif type(detector_url)==tuple and detector_url[1]=='2d':
-        features = detector(images.to(opts.device), **detector_kwargs)
-    elif type(detector_url)==tuple and detector_url[1]=='3d':
-        features = detector(images.to(opts.device))
-    return features
+    with detector_inference(opts):
+        if type(detector_url)==tuple and detector_url[1]=='2d':
+            features = detector(to_channels_last(opts, images.to(opts.device, non_blocking=True)), **detector_kwargs)
+        elif type(detector_url)==tuple and detector_url[1]=='vgg16':
+            images = adjust_size_embedder(opts, images.to(opts.device, non_blocking=True))
+            features = detector(to_channels_last(opts, images), **detector_kwargs)
+        elif type(detector_url)==tuple and detector_url[1]=='3d':
+            features = detector(to_channels_last(opts, images.to(opts.device, non_blocking=True)), tile_size=opts.tile_size_3d, tile_overlap=opts.tile_overlap_3d)
+    return features.float()
 
 def define_detector(opts, detector_url, progress):
-    if type(detector_url)==dict:
-        detector = load_embedder(detector_url)
-    else:
-        detector = get_feature_detector(url=detector_url, device=opts.device, num_gpus=opts.num_gpus, rank=opts.rank, verbose=progress.verbose)
+    detector = get_feature_detector(url=detector_url, device=opts.device, num_gpus=opts.num_gpus, rank=opts.rank, verbose=progress.verbose, precision=opts.detector_precision)
     return detector
 
+_precision_drift_reported = set()
+
+def report_precision_drift(opts, images, detector, detector_url, detector_kwargs):
+    """
+    Compare the features of a probe batch at opts.detector_precision with fp32 features,
+    print the drift and record it in <run_dir>/detector_precision_drift.json.
+    """
+    key = (get_feature_detector_name(detector_url), opts.detector_precision)
+    if opts.detector_precision == 'fp32' or opts.rank != 0 or key in _precision_drift_reported:
+        return
+    _precision_drift_reported.add(key)
+    reference = get_feature_detector(url=detector_url, device=opts.device, precision='fp32')
+    ref_opts = copy.copy(opts)
+    ref_opts.detector_precision = 'fp32'
+    features = extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs)
+    ref_features = extract_features_from_detector(ref_opts, images, reference, detector_url, detector_kwargs)
+    rel_error = ((features - ref_features).norm(dim=1) / ref_features.norm(dim=1).clamp(min=1e-12)).cpu()
+    cosine = F.cosine_similarity(features, ref_features, dim=1).cpu()
+    drift = dict(
+        num_probe_items     = int(images.shape[0]),
+        mean_relative_error = float(rel_error.mean()),
+        max_relative_error  = float(rel_error.max()),
+        min_cosine          = float(cosine.min()),
+    )
+    print(f"Feature drift of {key[0]} with detector_precision={key[1]!r} vs fp32: mean relative error {drift['mean_relative_error']:.2e}, "
+          f"max relative error {drift['max_relative_error']:.2e}, min cosine similarity {drift['min_cosine']:.6f}")
+    report_file = os.path.join(opts.run_dir, 'detector_precision_drift.json')
+    try:
+        with open(report_file, 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        report = {}
+    report[f'{key[0]}|{key[1]}'] = drift
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+#----------------------------------------------------------------------------
+# Detector batch-size autotuning. The chosen values are cached per machine in
+# <cache_dir>/batch_sizes.json, keyed on the host, the device, the detector and
+# the input shape.
+
+def _is_oom_error(e):
+    if isinstance(e, (MemoryError, torch.cuda.OutOfMemoryError)):
+        return True
+    return isinstance(e, RuntimeError) and ('out of memory' in str(e) or "can't allocate memory" in str(e))
+
+def _machine_tag(device):
+    if device.type == 'cuda':
+        props = torch.cuda.get_device_properties(device)
+        return f'{platform.node()}|{props.name}|{props.total_memory}'
+    return f'{platform.node()}|cpu{os.cpu_count()}|{psutil.virtual_memory().total}'
+
+class _PeakRSS:
+    """Track the peak resident set size of this process by polling it from a background thread."""
+    def __init__(self, interval=0.005):
+        self._process = psutil.Process()
+        self._interval = interval
+        self._done = threading.Event()
+        self.base = self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        while not self._done.wait(self._interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+def tune_batch_size(opts, detector, detector_url, detector_kwargs, sample, max_batch_size=1024, memory_fraction=0.8, max_probe_time=10.0):
+    """
+    Largest power-of-two batch size (up to max_batch_size) at which the detector
+    processes inputs shaped like `sample` ([1, C, ...]) on opts.device. Batch sizes
+    are doubled until a probe runs out of memory (CUDA or host), the next doubling
+    would exceed memory_fraction of the memory available, or a probe takes longer
+    than max_probe_time seconds.
+
+    With several GPUs, the batch size is tuned (and cached) by rank 0 and broadcast
+    to the other ranks: FeatureStats.append_torch() gathers the features batch by
+    batch, so all the ranks must use the same batch size.
+    """
+    batch_size = _probe_batch_size(opts, detector, detector_url, detector_kwargs, sample, max_batch_size, memory_fraction, max_probe_time) if opts.rank == 0 else 0
+    if opts.num_gpus > 1:
+        batch_size = torch.as_tensor(batch_size, dtype=torch.int64, device=opts.device)
+        torch.distributed.broadcast(tensor=batch_size, src=0)
+        batch_size = int(batch_size.cpu())
+    return batch_size
+
+def _probe_batch_size(opts, detector, detector_url, detector_kwargs, sample, max_batch_size, memory_fraction, max_probe_time):
+    device = torch.device(opts.device)
+    cache_file = dnnlib.make_cache_dir_path('batch_sizes.json')
+    key = '|'.join([_machine_tag(device), get_feature_detector_name(detector_url), opts.detector_precision, str(tuple(sample.shape[1:]))])
+    if detector_url[1] == '3d' and opts.tile_size_3d is not None:
+        key += f'|tile{opts.tile_size_3d}'
+    try:
+        with open(cache_file, 'r') as f:
+            tuned = json.load(f)
+    except (OSError, ValueError):
+        tuned = {}
+    if key in tuned:
+        return tuned[key]
+
+    batch_size = 0
+    probe = 1
+    while probe <= max_batch_size:
+        images = sample.expand(probe, *sample.shape[1:]).contiguous()
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+        else:
+            rss = _PeakRSS()
+        try:
+            t0 = time.time()
+            extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            elapsed = time.time() - t0
+        except Exception as e:
+            if not _is_oom_error(e):
+                raise
+            break
+        finally:
+            del images
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+            else:
+                rss.stop()
+        batch_size = probe
+        if device.type == 'cuda':
+            peak, available = torch.cuda.max_memory_allocated(device), torch.cuda.get_device_properties(device).total_memory
+        else:
+            base, peak, available = rss.base, rss.peak, rss.base + psutil.virtual_memory().available
+        if base + 2 * (peak - base) > memory_fraction * available or elapsed > max_probe_time:
+            break
+        probe *= 2
+    batch_size = max(batch_size, 1)
+
+    if opts.progress.verbose:
+        print(f'Batch size for {get_feature_detector_name(detector_url)} on inputs of shape {tuple(sample.shape[1:])}: {batch_size}')
+    tuned[key] = batch_size
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = cache_file + '.' + uuid.uuid4().hex
+        with open(temp_file, 'w') as f:
+            json.dump(tuned, f, indent=2)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+    return batch_size
+
 def plot_losses(train, val=None, *, save_path=None,
                 title="Training/Validation Loss",
                 relative=False,          # normalize by first finite value
@@ -929,21 +1433,248 @@ def get_OC_model(opts, X=None, OC_params=None, OC_hyperparams=None, use_pretrain
 
 #----------------------------------------------------------------------------
 
+def get_feature_cache_key(opts, dataset, dataset_kwargs, detector_url, detector_kwargs, max_items=None, stats_kwargs=None, per_item=False):
+    """
+    Key of the on-disk feature cache: a fingerprint of the files the dataset is
+    read from, the remaining dataset parameters, the detector identity and the
+    preprocessing applied before it.
+
+    With per_item=True, the key identifies a per-file feature cache instead:
+    the files are tracked individually by the cache itself, so the key leaves
+    out everything that selects items rather than changing their features.
+    """
+    dataset_kwargs = dict(dataset_kwargs) if dataset_kwargs is not None else dict(path_data=dataset.path_data, class_name=type(dataset).__name__)
+    path_data = dataset_kwargs.pop('path_data')
+    path_labels = dataset_kwargs.pop('path_labels', None)
+    for key in ['lazy', 'num_threads', 'num_processes', 'cache_mb', 'spill_dir', 'read_ahead']:
+        dataset_kwargs.pop(key, None) # Load the same items
+    args = dict(
+        detector_url    = sorted(detector_url.items()) if isinstance(detector_url, dict) else detector_url,
+        detector_kwargs = sorted(detector_kwargs.items()),
+        preprocessing   = dict(data_type=opts.data_type.lower(), padding=bool(opts.padding)),
+    )
+    if opts.detector_precision != 'fp32':
+        args.update(detector_precision=opts.detector_precision)
+    if opts.tile_size_3d is not None and opts.data_type.lower() == '3d':
+        args.update(tiling_3d=(opts.tile_size_3d, opts.tile_overlap_3d))
+    if per_item:
+        for key in ['use_labels', 'size_dataset', 'max_size']:
+            dataset_kwargs.pop(key, None)
+        args.update(dataset_kwargs=sorted(dataset_kwargs.items()), content_hash=bool(opts.cache_content_hash))
+    else:
+        args.update(
+            data            = dataset_fingerprint(path_data, hash_content=opts.cache_content_hash),
+            labels          = dataset_fingerprint(path_labels, hash_content=opts.cache_content_hash) if path_labels is not None else None,
+            dataset_kwargs  = sorted(dataset_kwargs.items()),
+            max_items       = max_items,
+            stats_kwargs    = sorted((stats_kwargs or {}).items()),
+        )
+    return repr(sorted(args.items()))
+
+def get_item_subset(opts, indices):
+    """Indices processed by this rank; interleaving the ranks' outputs restores the order of `indices`."""
+    num_items = len(indices)
+    if opts.num_gpus > 0:
+        return [indices[(i * opts.num_gpus + opts.rank) % num_items] for i in range((num_items - 1) // opts.num_gpus + 1)]
+    return list(indices)
+
+def run_detector_on_dataset(opts, dataset, detector, detector_url, detector_kwargs, item_subset, stats, progress, data_loader_kwargs=None, return_imgs=False):
+    """
+    Append the features of the items in item_subset to stats. With return_imgs=True,
+    returns the (expanded) images of all the items; otherwise only those of the last batch.
+    """
+    if data_loader_kwargs is None:
+        data_loader_kwargs = get_data_loader_kwargs(opts, dataset)
+    batch_size = opts.batch_size
+    if opts.auto_batch_size and len(item_subset) > 0:
+        sample = torch.as_tensor(dataset[item_subset[0]][0])[None]
+        if sample.shape[1] == 1 and opts.data_type in ['2d', '2D']:
+            sample = sample.repeat([1, 3, 1, 1])
+        batch_size = tune_batch_size(opts, detector, detector_url, detector_kwargs, sample)
+    data_loader = torch.utils.data.DataLoader(dataset=dataset, sampler=item_subset, batch_size=batch_size, worker_init_fn=seed_worker, generator=torch.Generator().manual_seed(opts.seed), **data_loader_kwargs)
+    use_cuda = torch.device(opts.device).type == 'cuda'
+
+    # Pipeline: a background thread loads, expands and pins batch i+1 while the
+    # detector runs on batch i, and the features of batch i-1 are copied to the
+    # host asynchronously and appended only after batch i has been launched.
+    def stage(batch):
+        images, _labels = batch
+        if images.shape[1] == 1 and opts.data_type in ['2d', '2D']:
+            images = images.repeat([1, 3, 1, 1])
+        if use_cuda and not images.is_pinned():
+            images = images.pin_memory()
+        return images
+
+    def to_host(features):
+        # With multiple GPUs, append_torch() gathers the features from the device itself.
+        if not use_cuda or opts.num_gpus > 1:
+            return features, None
+        host = torch.empty(features.shape, dtype=features.dtype, pin_memory=True)
+        host.copy_(features, non_blocking=True)
+        copied = torch.cuda.Event()
+        copied.record()
+        return host, copied
+
+    def flush(pending):
+        features, copied = pending
+        if copied is not None:
+            copied.synchronize()
+        stats.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
+        progress.update(stats.num_items)
+
+    # Without DataLoader workers, datasets that decode volumes on access (BidsDataset)
+    # decode the next items in the sampler order in the background.
+    read_ahead = data_loader_kwargs.get('num_workers', 0) == 0 and hasattr(dataset, 'prefetch')
+    if read_ahead:
+        dataset.prefetch(item_subset)
+
+    images = None
+    all_images = []
+    pending = None
+    try:
+        for images in prefetch(data_loader, fn=stage):
+            if return_imgs:
+                all_images.append(images)
+            report_precision_drift(opts, images, detector, detector_url, detector_kwargs)
+            features = extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs)
+            if pending is not None:
+                flush(pending)
+            pending = to_host(features)
+        if pending is not None:
+            flush(pending)
+    finally:
+        if read_ahead:
+            dataset.stop_prefetch()
+    if return_imgs and len(all_images) > 1:
+        images = torch.cat(all_images)
+    return images
+
+def save_item_cache(cache_dir, signatures, features, raw_mean=None, raw_cov=None):
+    def write(temp_dir):
+        write_cache_meta(temp_dir, signatures=signatures, num_features=int(features.shape[1]))
+        np.save(os.path.join(temp_dir, 'features.npy'), features)
+        if raw_mean is not None:
+            np.savez(os.path.join(temp_dir, 'mean_cov.npz'), raw_mean=raw_mean, raw_cov=raw_cov)
+    write_cache_dir(cache_dir, write)
+
+def load_item_cache(cache_dir):
+    meta = read_cache_meta(cache_dir)
+    if meta is None:
+        return None
+    cached = dnnlib.EasyDict(signatures=meta['signatures'], raw_mean=None, raw_cov=None)
+    cached.features = np.load(os.path.join(cache_dir, 'features.npy'), mmap_mode='r')
+    if os.path.isfile(os.path.join(cache_dir, 'mean_cov.npz')):
+        with np.load(os.path.join(cache_dir, 'mean_cov.npz')) as f:
+            cached.raw_mean, cached.raw_cov = f['raw_mean'], f['raw_cov']
+    return cached
+
+def compute_feature_stats_per_item(opts, dataset, item_paths, detector_url, detector_kwargs, cache_file, num_items, rel_lo=0, rel_hi=1, data_loader_kwargs=None, **stats_kwargs):
+    """
+    Incremental variant of compute_feature_stats_for_dataset() for datasets whose
+    items map one-to-one to files. The cache stores the features of every file
+    together with its signature, so only new or changed files go through the
+    detector; the mean/cov sums of the cached rows are updated incrementally.
+    """
+    root = os.path.abspath(dataset.path_data)
+    root = root if os.path.isdir(root) else os.path.dirname(root)
+    signatures = [os.path.relpath(os.path.abspath(p), root).replace(os.sep, '/') + '|' + file_signature(p, hash_content=opts.cache_content_hash) for p in item_paths[:num_items]]
+
+    # Load the cached rows.
+    cached = load_item_cache(cache_file)
+    cached_rows = {sig: row for row, sig in enumerate(cached.signatures)} if cached is not None else dict()
+    missing = [idx for idx, sig in enumerate(signatures) if sig not in cached_rows]
+    current = set(signatures)
+    removed = [row for sig, row in cached_rows.items() if sig not in current]
+
+    # Run the detector on new or changed files only.
+    new_stats = None
+    if len(missing) > 0:
+        print(f'Extracting features from {len(missing)} new or changed file(s) out of {num_items}...')
+        new_stats = FeatureStats(capture_all=True, max_items=len(missing), spill_dir=opts.feature_spill_dir)
+        progress = opts.progress.sub(tag='dataset features', num_items=len(missing), rel_lo=rel_lo, rel_hi=rel_hi)
+        detector = define_detector(opts, detector_url, progress)
+        run_detector_on_dataset(opts, dataset, detector, detector_url, detector_kwargs, get_item_subset(opts, missing), new_stats, progress, data_loader_kwargs)
+    new_features = new_stats.get_all() if new_stats is not None else None
+
+    # Merge with the cached rows, in dataset order.
+    num_features = cached.features.shape[1] if cached is not None else new_features.shape[1]
+    if cached is not None and signatures == cached.signatures:
+        features = cached.features # Unchanged dataset: use the memory-mapped rows as they are.
+    else:
+        features = alloc_features(num_items, num_features, opts.feature_spill_dir)
+        if new_features is not None:
+            features[missing] = new_features
+        hits = [(idx, cached_rows[sig]) for idx, sig in enumerate(signatures) if sig in cached_rows]
+        if len(hits) > 0:
+            idx, rows = map(list, zip(*hits))
+            features[idx] = cached.features[rows]
+
+    # Update the mean/cov sums: drop the rows of removed files, add the new ones.
+    stats = FeatureStats(max_items=num_items, **stats_kwargs)
+    raw_mean = raw_cov = None
+    if cached is not None and cached.raw_mean is not None:
+        raw_mean, raw_cov = cached.raw_mean.copy(), cached.raw_cov.copy()
+        accumulate_mean_cov(raw_mean, raw_cov, cached.features[removed], sign=-1)
+        if new_features is not None:
+            accumulate_mean_cov(raw_mean, raw_cov, new_features)
+    elif stats.capture_mean_cov:
+        raw_mean = np.zeros([num_features], dtype=np.float64)
+        raw_cov = np.zeros([num_features, num_features], dtype=np.float64)
+        accumulate_mean_cov(raw_mean, raw_cov, features)
+    sums_added = (raw_mean is not None) and (cached is None or cached.raw_mean is None)
+
+    # Save to cache.
+    if opts.rank == 0 and (len(missing) > 0 or len(removed) > 0 or sums_added):
+        save_item_cache(cache_file, signatures, features, raw_mean, raw_cov)
+
+    # Assemble the requested stats.
+    stats.set_num_features(num_features)
+    stats.num_items = num_items
+    if stats.capture_all:
+        stats.all_features.append(features)
+    if stats.capture_mean_cov:
+        stats.raw_mean, stats.raw_cov = raw_mean, raw_cov
+    return stats
+
 def compute_feature_stats_for_dataset(opts, dataset, detector_url, detector_kwargs, rel_lo=0, rel_hi=1, dataset_kwargs=None, data_loader_kwargs=None, max_items=None, return_imgs=False, item_subset=None, **stats_kwargs):
     if data_loader_kwargs is None:
-        data_loader_kwargs = dict(pin_memory=True, num_workers=0)
+        data_loader_kwargs = get_data_loader_kwargs(opts, dataset)
+
+    # Try to lookup from the run-scoped feature store.
+    store_key = None
+    if opts.feature_store is not None and dataset_kwargs is not None and not return_imgs and item_subset is None:
+        store_key = FeatureStore.make_key(opts, dataset_kwargs, detector_url, detector_kwargs, max_items)
+        stats = opts.feature_store.get(store_key, **stats_kwargs)
+        if stats is not None:
+            return stats
+        stats_kwargs = dict(stats_kwargs, capture_all=True)
+
+    # Initialize.
+    num_items = len(dataset)
+    if max_items is not None:
+        num_items = min(num_items, max_items)
+
+    # Per-file cache: only new or changed files are embedded.
+    item_paths = dataset.item_paths() if hasattr(dataset, 'item_paths') else None
+    if opts.cache and item_paths is not None and len(item_paths) == len(dataset) and not return_imgs and item_subset is None:
+        md5 = hashlib.md5(get_feature_cache_key(opts, dataset, dataset_kwargs, detector_url, detector_kwargs, per_item=True).encode('utf-8'))
+        cache_file = dnnlib.make_cache_dir_path('gan-metrics', f'{dataset.name}-{get_feature_detector_name(detector_url)}-{md5.hexdigest()}-items')
+        stats = compute_feature_stats_per_item(opts, dataset, item_paths, detector_url, detector_kwargs, cache_file, num_items,
+                                               rel_lo=rel_lo, rel_hi=rel_hi, data_loader_kwargs=data_loader_kwargs, **stats_kwargs)
+        if store_key is not None:
+            opts.feature_store.put(store_key, stats)
+        return stats
 
     # Try to lookup from cache.
     cache_file = None
     if opts.cache:
         # Choose cache file name.
-        args = dict(dataset_kwargs=dataset_kwargs, detector_url=detector_url, detector_kwargs=detector_kwargs, stats_kwargs=stats_kwargs)
-        md5 = hashlib.md5(repr(sorted(args.items())).encode('utf-8'))
+        md5 = hashlib.md5(get_feature_cache_key(opts, dataset, dataset_kwargs, detector_url, detector_kwargs, max_items, stats_kwargs).encode('utf-8'))
         cache_tag = f'{dataset.name}-{get_feature_detector_name(detector_url)}-{md5.hexdigest()}'
-        cache_file = dnnlib.make_cache_dir_path('gan-metrics', cache_tag + '.pkl')
+        cache_file = dnnlib.make_cache_dir_path('gan-metrics', cache_tag)
 
-        # Check if the file exists (all processes must agree).
-        flag = os.path.isfile(cache_file) if opts.rank == 0 else False
+        # Check if the entry exists (all processes must agree).
+        flag = (read_cache_meta(cache_file) is not None) if opts.rank == 0 else False
         if opts.num_gpus > 1:
             flag = torch.as_tensor(flag, dtype=torch.float32, device=opts.device)
             torch.distributed.broadcast(tensor=flag, src=0)
@@ -951,37 +1682,26 @@ def compute_feature_stats_for_dataset(opts, dataset, detector_url, detector_kwar
 
         # Load.
         if flag and not return_imgs:
-            return FeatureStats.load(cache_file)
+            stats = FeatureStats.load(cache_file)
+            if store_key is not None and stats.capture_all:
+                opts.feature_store.put(store_key, stats)
+            return stats
 
-    # Initialize.
-    num_items = len(dataset)
-    if max_items is not None:
-        num_items = min(num_items, max_items)
-    stats = FeatureStats(max_items=num_items, **stats_kwargs)
+    stats = FeatureStats(max_items=num_items, spill_dir=opts.feature_spill_dir, **stats_kwargs)
     print('Extracting features from dataset...')
     progress = opts.progress.sub(tag='dataset features', num_items=num_items, rel_lo=rel_lo, rel_hi=rel_hi)
     detector = define_detector(opts, detector_url, progress)
 
     # Main loop.
     if item_subset is None:
-        if opts.num_gpus>0:
-            item_subset = [(i * opts.num_gpus + opts.rank) % num_items for i in range((num_items - 1) // opts.num_gpus + 1)]
-        else:
-            item_subset = list(range(num_items))
-        
-    for images, _labels in torch.utils.data.DataLoader(dataset=dataset, sampler=item_subset, batch_size=opts.batch_size, worker_init_fn=seed_worker, generator=torch.Generator().manual_seed(opts.seed), **data_loader_kwargs):
-        if images.shape[1] == 1 and opts.data_type in ['2d', '2D']:
-            images = images.repeat([1, 3, 1, 1])
-        features = extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs)
-        stats.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
-        progress.update(stats.num_items)
+        item_subset = get_item_subset(opts, list(range(num_items)))
+    images = run_detector_on_dataset(opts, dataset, detector, detector_url, detector_kwargs, item_subset, stats, progress, data_loader_kwargs, return_imgs=return_imgs)
 
     # Save to cache.
     if cache_file is not None and opts.rank == 0:
-        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-        temp_file = cache_file + '.' + uuid.uuid4().hex
-        stats.save(temp_file)
-        os.replace(temp_file, cache_file) # atomic
+        stats.save(cache_file)
+    if store_key is not None:
+        opts.feature_store.put(store_key, stats)
     if return_imgs:
         return stats, images[:,0,:,:]
     else:
@@ -993,9 +1713,18 @@ def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel
         batch_gen = min(opts.batch_size, 4)
     assert opts.batch_size % batch_gen == 0
 
+    # Try to lookup from the run-scoped feature store.
+    store_key = None
+    if opts.feature_store is not None and not return_imgs:
+        store_key = FeatureStore.make_key(opts, ('generator', opts.gen_path), detector_url, detector_kwargs, stats_kwargs.get('max_items'))
+        stats = opts.feature_store.get(store_key, **stats_kwargs)
+        if stats is not None:
+            return stats
+        stats_kwargs = dict(stats_kwargs, capture_all=True)
+
     # Setup generator and load labels.
     G = copy.deepcopy(opts.G).eval().requires_grad_(False).to(opts.device)
-    dataset = dnnlib.util.construct_class_by_name(**opts.dataset_kwargs)
+    dataset = construct_dataset(opts.dataset_kwargs, opts.dataset_registry)
 
     # JIT.
     if jit:
@@ -1007,7 +1736,7 @@ def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel
             run_generator = torch.jit.trace(opts.run_generator, [z, opts], check_trace=False)
         
     # Initialize.
-    stats = FeatureStats(**stats_kwargs)
+    stats = FeatureStats(spill_dir=opts.feature_spill_dir, **stats_kwargs)
     assert stats.max_items is not None
     progress = opts.progress.sub(tag='generator features', num_items=stats.max_items, rel_lo=rel_lo, rel_hi=rel_hi)
     detector = define_detector(opts, detector_url, progress)
@@ -1029,6 +1758,8 @@ def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel
         features = extract_features_from_detector(opts, images, detector, detector_url, detector_kwargs)
         stats.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
         progress.update(stats.num_items)
+    if store_key is not None:
+        opts.feature_store.put(store_key, stats)
     if return_imgs:
         return stats, images[:,0,:,:]
     else:
@@ -1043,9 +1774,9 @@ def compute_feature_stats_synthetic(opts, detector_url, detector_kwargs, rel_lo=
             rel_lo=rel_lo, rel_hi=rel_hi, **stats_kwargs)
     else:
         gen_features = compute_feature_stats_for_dataset(
-            opts=opts, dataset=dnnlib.util.construct_class_by_name(**opts.dataset_synt_kwargs),
+            opts=opts, dataset=construct_dataset(opts.dataset_synt_kwargs, opts.dataset_registry),
             detector_url=detector_url, detector_kwargs=detector_kwargs, 
-            rel_lo=rel_lo, rel_hi=rel_hi, **stats_kwargs)
+            rel_lo=rel_lo, rel_hi=rel_hi, dataset_kwargs=opts.dataset_synt_kwargs, **stats_kwargs)
         
     return gen_features
 
@@ -1187,10 +1918,10 @@ def visualize_top_k(opts, closest_images, closest_indices, top_n_real_indices, f
     Visualize the top-k closest synthetic images for the selected real images.
     """
     # Create a dataset and DataLoader for the real images
-    dataset = dnnlib.util.construct_class_by_name(**opts.dataset_kwargs)
+    dataset = construct_dataset(opts.dataset_kwargs, opts.dataset_registry)
 
     # Use the indices of the closest synthetic images to load the real images from the dataset
-    real_images, _ = next(iter(torch.utils.data.DataLoader(dataset=dataset, sampler=top_n_real_indices, batch_size=opts.batch_size, worker_init_fn=seed_worker, generator=torch.Generator().manual_seed(opts.seed))))
+    real_images, _ = next(iter(torch.utils.data.DataLoader(dataset=dataset, sampler=top_n_real_indices, batch_size=opts.batch_size, worker_init_fn=seed_worker, generator=torch.Generator().manual_seed(opts.seed), **get_data_loader_kwargs(opts, dataset))))
 
     # Collect the synthetic images corresponding to each real image from closest_images
     synthetic_images_to_visualize = [closest_images[real_idx][:k] for real_idx in top_n_real_indices]
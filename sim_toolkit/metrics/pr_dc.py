@@ -65,7 +65,7 @@ def compute_prdc(opts, max_real, num_gen):
 
     # detector_url = 'https://nvlabs-fi-cdn.nvidia.com/stylegan2-ada-pytorch/pretrained/metrics/vgg16.pt'
     if opts.data_type.lower() == '2d':
-        detector_url = {'model': 'vgg16', 'randomise': False, 'dim64': False}
+        detector_url = ('https://download.pytorch.org/models/vgg16-397923af.pth', 'vgg16')
     elif opts.data_type.lower() == '3d':
         detector_url = ('https://zenodo.org/records/15234379/files/resnet_50_23dataset_cpu.pth?download=1', '3d')
     detector_kwargs = dict(return_features=True)
@@ -73,7 +73,7 @@ def compute_prdc(opts, max_real, num_gen):
     # Compute the embedding from pre-trained detector
 
     real_features = metric_utils.compute_feature_stats_for_dataset(
-        opts=opts, dataset=dnnlib.util.construct_class_by_name(**opts.dataset_kwargs), 
+        opts=opts, dataset=metric_utils.construct_dataset(opts.dataset_kwargs, opts.dataset_registry), 
         detector_url=detector_url, detector_kwargs=detector_kwargs,
         rel_lo=0, rel_hi=0, dataset_kwargs=opts.dataset_kwargs, capture_all=True, max_items=max_real).get_all_torch().to(torch.float32).to(opts.device)
 
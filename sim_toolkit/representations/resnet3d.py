@@ -7,7 +7,7 @@ from functools import partial
 
 __all__ = [
     'ResNet', 'resnet10', 'resnet18', 'resnet34', 'resnet50', 'resnet101',
-    'resnet152', 'resnet200'
+    'resnet152', 'resnet200', 'ResNetFeatures', 'resnet50_features'
 ]
 
 
@@ -211,6 +211,42 @@ class ResNet(nn.Module):
 
         return x
 
+
+class ResNetFeatures(ResNet):
+    """
+    Feature-only ResNet: the backbone of ResNet without the segmentation head,
+    truncated after `out_stage`. Accepts the state_dict of the full model
+    (load it with strict=False).
+    """
+
+    stages = ['layer1', 'layer2', 'layer3', 'layer4']
+
+    def __init__(self, block, layers, out_stage='layer4', **kwargs):
+        super(ResNetFeatures, self).__init__(block, layers, **kwargs)
+        assert out_stage in self.stages
+        self.out_stage = out_stage
+        del self.conv_seg
+        for stage in self.stages[self.stages.index(out_stage) + 1:]:
+            delattr(self, stage)
+
+    def forward(self, x, pooled_taps=None):
+        """
+        Output of `out_stage`; with pooled_taps (e.g. ['layer3', 'layer4']), a dict
+        with the globally average-pooled output of each of those stages instead.
+        """
+        x = self.conv1(x)
+        x = self.bn1(x)
+        x = self.relu(x)
+        x = self.maxpool(x)
+
+        taps = {}
+        for stage in self.stages[:self.stages.index(self.out_stage) + 1]:
+            x = getattr(self, stage)(x)
+            if pooled_taps is not None and stage in pooled_taps:
+                taps[stage] = x.mean(dim=(-1, -2, -3))
+
+        return taps if pooled_taps is not None else x
+
 def resnet10(**kwargs):
     """Constructs a ResNet-18 model.
     """
@@ -239,6 +275,13 @@ def resnet50(**kwargs):
     return model
 
 
+def resnet50_features(**kwargs):
+    """Constructs a feature-only ResNet-50 model.
+    """
+    model = ResNetFeatures(Bottleneck, [3, 4, 6, 3], **kwargs)
+    return model
+
+
 def resnet101(**kwargs):
     """Constructs a ResNet-101 model.
     """
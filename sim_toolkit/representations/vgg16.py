@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-FileCopyrightText: Copyright (c) Soumith Chintala 2016
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# VGG-16 network, derived from torchvision.models.vgg (BSD 3-clause license).
+
+import torch
+import torch.nn as nn
+
+__all__ = ['VGG16', 'vgg16']
+
+# Same layer layout (and state_dict keys) as torchvision.models.vgg16, so that the
+# torchvision ImageNet weights can be loaded without importing torchvision.
+cfg = [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 'M', 512, 512, 512, 'M', 512, 512, 512, 'M']
+
+
+def make_layers(cfg, in_channels=3):
+    layers = []
+    for v in cfg:
+        if v == 'M':
+            layers += [nn.MaxPool2d(kernel_size=2, stride=2)]
+        else:
+            layers += [nn.Conv2d(in_channels, v, kernel_size=3, padding=1), nn.ReLU(inplace=True)]
+            in_channels = v
+    return nn.Sequential(*layers)
+
+
+class VGG16(nn.Module):
+
+    def __init__(self, num_classes=1000):
+        super(VGG16, self).__init__()
+        self.features = make_layers(cfg)
+        self.avgpool = nn.AdaptiveAvgPool2d((7, 7))
+        self.classifier = nn.Sequential(
+            nn.Linear(512 * 7 * 7, 4096),
+            nn.ReLU(True),
+            nn.Dropout(),
+            nn.Linear(4096, 4096),
+            nn.ReLU(True),
+            nn.Dropout(),
+            nn.Linear(4096, num_classes),
+        )
+
+    def forward(self, x, return_features=False):
+        x = self.features(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        if return_features:
+            # Output of the second fully-connected layer (fc2, after ReLU)
+            return self.classifier[:5](x)
+        return self.classifier(x)
+
+
+def vgg16(**kwargs):
+    """Constructs a VGG-16 model."""
+    return VGG16(**kwargs)
@@ -0,0 +1,11 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import pytest
+
+from sim_toolkit import dnnlib
+
+@pytest.fixture(autouse=True)
+def _cache_dir(tmp_path, monkeypatch):
+    # Keep the dataset stats and other caches of each test in its own directory.
+    monkeypatch.setattr(dnnlib.util, "_dnnlib_cache_dir", str(tmp_path / "cache"))
@@ -0,0 +1,22 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import numpy as np
+import pytest
+
+from sim_toolkit.datasets.nifti import NiftiDataset2D
+
+nib = pytest.importorskip("nibabel")
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_folder_without_readable_2d_images_lists_reasons(tmp_path, lazy):
+    data = tmp_path / "data"
+    data.mkdir()
+    nib.save(nib.Nifti1Image(np.zeros((8, 8, 8, 2), dtype=np.float32), np.eye(4)), str(data / "volume.nii.gz"))
+
+    with pytest.raises(RuntimeError) as excinfo:
+        NiftiDataset2D(str(data), lazy=lazy)
+    message = str(excinfo.value)
+    assert message.startswith(f"No readable 2D NIfTI images loaded from {data}.")
+    assert "Some reasons:" in message
+    assert "volume.nii.gz: 4D array (8, 8, 8, 2) not supported for 2D dataset." in message
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from sim_toolkit.datasets import png
+from sim_toolkit.datasets.png import PNGDataset
+
+def _write_png16(path, array):
+    Image.fromarray(array.astype(np.uint16)).save(path)
+
+@pytest.mark.parametrize("use_pyspng", [True, False])
+def test_16bit_png_is_rescaled_to_8bit_range(tmp_path, monkeypatch, use_pyspng):
+    if not use_pyspng:
+        monkeypatch.setattr(png, "_pyspng", lambda: None)
+    data = tmp_path / "data"
+    data.mkdir()
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 2**16, size=(16, 12)) for _ in range(3)]
+    images[0][0, 0], images[0][0, 1] = 0, 2**16 - 1
+    for i, image in enumerate(images):
+        _write_png16(data / f"{i}.png", image)
+
+    dataset = PNGDataset(str(data))
+    assert dataset.image_shape == [1, 16, 12]
+    assert dataset._dtype == np.float32
+    assert dataset._min == 0 and dataset._max == 255
+    for i, image in enumerate(images):
+        item, _label = dataset[i]
+        np.testing.assert_allclose(item.numpy()[0], image / 257, rtol=0, atol=1e-4)
+
+def test_8bit_png_is_unchanged(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    image = np.random.RandomState(0).randint(0, 256, size=(8, 8, 3)).astype(np.uint8)
+    Image.fromarray(image).save(data / "0.png")
+
+    dataset = PNGDataset(str(data))
+    assert dataset._dtype == np.uint8
+    np.testing.assert_array_equal(dataset[0][0].numpy(), image.transpose(2, 0, 1))
@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from sim_toolkit.metrics.metric_utils import resize_batch
+
+# resize_batch() must match the per-image PIL bicubic resize it replaced, up to PIL's
+# fixed-point rounding: at most 2 grey levels, on a small fraction of the pixels.
+MAX_ABS_DIFF = 2
+MAX_DIFF_FRACTION = 0.05
+
+def _resize_pil(batch, size):
+    images = []
+    for image in batch.numpy():
+        image = Image.fromarray(image[0] if image.shape[0] == 1 else image.transpose(1, 2, 0))
+        image = np.array(image.resize((size, size), resample=Image.BICUBIC))
+        images.append(image[np.newaxis] if image.ndim == 2 else image.transpose(2, 0, 1))
+    return np.stack(images)
+
+def _smooth_batch(n, c, h, w):
+    yy, xx = np.mgrid[0:h, 0:w]
+    image = (127 + 120 * np.sin(yy / 7) * np.cos(xx / 11)).astype(np.uint8)
+    return np.broadcast_to(image, (n, c, h, w)).copy()
+
+@pytest.mark.parametrize("channels", [1, 3])
+@pytest.mark.parametrize("shape", [(64, 64), (224, 224), (300, 180), (512, 512)])
+@pytest.mark.parametrize("content", ["noise", "smooth"])
+def test_resize_batch_matches_pil_bicubic(channels, shape, content):
+    h, w = shape
+    if content == "noise":
+        batch = np.random.RandomState(0).randint(0, 256, size=(4, channels, h, w)).astype(np.uint8)
+    else:
+        batch = _smooth_batch(4, channels, h, w)
+    batch = torch.from_numpy(batch)
+
+    out = resize_batch(batch, 224)
+    assert out.dtype == torch.uint8
+    assert tuple(out.shape) == (4, channels, 224, 224)
+
+    diff = np.abs(out.numpy().astype(np.int32) - _resize_pil(batch, 224).astype(np.int32))
+    assert diff.max() <= MAX_ABS_DIFF
+    assert (diff > 0).mean() <= MAX_DIFF_FRACTION
@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import pytest
+import torch
+
+from sim_toolkit.metrics.metric_utils import ResNet3DEmbedder
+from sim_toolkit.representations import resnet3d
+
+@pytest.fixture(scope="module")
+def embedder(tmp_path_factory):
+    # Random weights: these tests check the tiling arithmetic, not the features.
+    torch.manual_seed(0)
+    model = resnet3d.resnet50_features(out_stage='layer4', shortcut_type='B', no_cuda=True)
+    checkpoint = tmp_path_factory.mktemp("resnet3d") / "random.pth"
+    torch.save({'state_dict': model.state_dict()}, checkpoint)
+    return ResNet3DEmbedder(str(checkpoint), 'cpu')
+
+@pytest.mark.parametrize("size", [24, 40, 64, 100, 128])
+@pytest.mark.parametrize("tile_size, tile_overlap", [(32, 16), (48, 16), (64, 32)])
+def test_tiles_share_out_the_layer4_output(embedder, size, tile_size, tile_overlap):
+    ranges = embedder._tile_ranges(size, tile_size, tile_overlap)
+    assert ranges[0][0] == 0 and ranges[-1][1] == size
+    assert ranges[0][2] == 0 and ranges[-1][3] == -(-size // embedder.stride)
+    for (start, end, keep_lo, keep_hi), (next_start, _end, next_lo, _hi) in zip(ranges, ranges[1:]):
+        assert keep_hi == next_lo                                   # no layer4 voxel counted twice or skipped
+        assert next_start < end                                     # neighbouring tiles overlap
+    for start, end, keep_lo, keep_hi in ranges:
+        assert start % embedder.stride == 0
+        assert start // embedder.stride <= keep_lo <= keep_hi <= -(-end // embedder.stride)
+
+def test_tile_covering_the_volume_matches_whole_volume(embedder):
+    x = torch.rand(1, 1, 32, 40, 24) * 255
+    whole = embedder(x)
+    tiled = embedder(x, tile_size=48, tile_overlap=16)
+    torch.testing.assert_close(tiled, whole, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,35 @@
+# SPDX-FileCopyrightText: 2025 Matteo Lai <matteo.lai3@unibo.it>
+# SPDX-License-Identifier: NPOSL-3.0
+
+import torch
+
+from sim_toolkit import dnnlib
+from sim_toolkit.metrics import metric_utils
+
+class _Dataset(torch.utils.data.Dataset):
+    def __init__(self, num_items):
+        self._data = torch.arange(num_items, dtype=torch.float32).reshape(-1, 1, 1, 1).expand(-1, 1, 8, 8).contiguous()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, idx):
+        return self._data[idx], torch.tensor(-1)
+
+def _opts(batch_size):
+    return dnnlib.EasyDict(batch_size=batch_size, auto_batch_size=False, data_type='2D', device=torch.device('cpu'),
+                           seed=0, num_gpus=1, rank=0, num_workers=0, prefetch_factor=None)
+
+def test_return_imgs_covers_all_batches(monkeypatch):
+    # The first channel of each image holds its index; its mean is the "feature".
+    monkeypatch.setattr(metric_utils, 'extract_features_from_detector', lambda opts, images, *args: images.mean(dim=(1, 2, 3))[:, None])
+    monkeypatch.setattr(metric_utils, 'report_precision_drift', lambda *args: None)
+    item_subset = list(range(16, 32))
+    stats = metric_utils.FeatureStats(capture_all=True, max_items=len(item_subset))
+
+    images = metric_utils.run_detector_on_dataset(_opts(batch_size=4), _Dataset(40), None, None, None, item_subset, stats,
+                                                  metric_utils.ProgressMonitor(), return_imgs=True)
+
+    assert images.shape == (16, 3, 8, 8)
+    assert images[:, 0, 0, 0].tolist() == item_subset
+    assert stats.get_all_torch()[:, 0].tolist() == item_subset